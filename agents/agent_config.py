@@ -55,6 +55,9 @@ WHISPER_URL = os.environ.get("WHISPER_URL", "http://whisper:8001")
 PIPER_URL = os.environ.get("PIPER_URL", "http://piper:5001")
 SIGNALING_URL = os.environ.get("SIGNALING_URL", "http://signaling:8080")
 
+# Audio format agents request from Piper: wav, or ogg_opus for ~10x smaller turns
+TTS_FORMAT = os.environ.get("TTS_FORMAT", "wav")
+
 # Conversation defaults
 DEFAULT_MAX_TURNS = 10
 DEFAULT_TOPIC = "What is the most exciting development in AI right now?"
@@ -8,10 +8,11 @@ import io
 import os
 import json
 import time
+import uuid
 import logging
 import httpx
 
-from agent_config import OLLAMA_BASE_URL, WHISPER_URL, PIPER_URL
+from agent_config import OLLAMA_BASE_URL, WHISPER_URL, PIPER_URL, TTS_FORMAT
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(name)s] %(message)s")
 
@@ -34,6 +35,8 @@ class VoiceAgent:
         })
 
         self.conversation_history: list[dict] = []
+        # Whisper remembers language and recent transcript per session id
+        self.stt_session = uuid.uuid4().hex
         self.logger = logging.getLogger(f"Agent:{self.name}")
 
         # HTTP client with generous timeouts for LLM
@@ -168,14 +171,14 @@ class VoiceAgent:
         return reply
 
     def speak(self, text: str) -> bytes | None:
-        """Convert text to speech using Piper TTS. Returns WAV audio bytes."""
+        """Convert text to speech using Piper TTS. Returns audio bytes in TTS_FORMAT."""
         self.logger.info(f"🔊 Speaking: {text[:60]}...")
         start = time.time()
 
         try:
             response = self.http.post(
                 f"{PIPER_URL}/synthesize",
-                json={"text": text, "voice": self.voice},
+                json={"text": text, "voice": self.voice, "format": TTS_FORMAT},
             )
             response.raise_for_status()
 
@@ -197,7 +200,12 @@ class VoiceAgent:
 
         try:
             files = {"file": ("speech.wav", io.BytesIO(audio_bytes), "audio/wav")}
-            response = self.http.post(f"{WHISPER_URL}/transcribe", files=files)
+            # Short conversational turns: greedy decode with the language pinned
+            response = self.http.post(
+                f"{WHISPER_URL}/transcribe",
+                files=files,
+                data={"profile": "realtime", "session_id": self.stt_session},
+            )
             response.raise_for_status()
 
             result = response.json()
@@ -214,6 +222,7 @@ class VoiceAgent:
     def reset(self):
         """Reset conversation state (but keep memory for now)."""
         # self.conversation_history = [] 
+        self.stt_session = uuid.uuid4().hex
         self.logger.info("🔄 Conversation reset (Memory retained)")
 
     def to_dict(self) -> dict:
@@ -3,15 +3,33 @@
 Simple HTTP server for Piper TTS
 """
 
+import asyncio
+import concurrent.futures
+import hashlib
+import io
 import json
-import subprocess
+import math
+import multiprocessing
 import tempfile
+import threading
+import time
 import os
-from fastapi import FastAPI, HTTPException
+import struct
+from collections import OrderedDict, deque
+import numpy as np
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from typing import Optional
 import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
+from piper import AudioChunk, PiperVoice, SynthesisConfig
+
+try:
+    import av
+except ImportError:  # optional: without PyAV only wav and pcm_s16le are served
+    av = None
 
 app = FastAPI(title="Piper TTS Server")
 
@@ -27,94 +45,780 @@ app.add_middleware(
 # Configuration
 # Configuration
 DEFAULT_MODEL_PATH = os.environ.get("PIPER_MODEL_PATH", "/models/en_US-amy-medium.onnx")
-PIPER_CMD = os.environ.get("PIPER_CMD", "piper")
-MODELS_DIR = "/models"
-AVAILABLE_MODELS = {}
+MODELS_DIR = os.environ.get("PIPER_MODELS_DIR", "/models")
+MODELS_POLL_INTERVAL = float(os.environ.get("PIPER_MODELS_POLL_INTERVAL", 10))  # seconds; 0 disables
+AVAILABLE_MODELS = {}  # voice name -> (model path, mtime)
+VOICE_INDEX = {}  # exact name or lowercase alias -> model path
+VOICE_CACHE_SIZE = int(os.environ.get("PIPER_VOICE_CACHE_SIZE", 4))  # loaded voices kept in memory
+# Voices loaded and warmed up before /ready reports ready, besides the default one
+PRELOAD_VOICES = [v.strip() for v in os.environ.get("PIPER_PRELOAD_VOICES", "").split(",") if v.strip()]
+WARMUP_TEXT = "Warming up."
+SYNTH_WORKERS = int(os.environ.get("PIPER_WORKERS", 2))  # concurrent syntheses
+SYNTH_PROCESSES = int(os.environ.get("PIPER_PROCESSES", min(4, os.cpu_count() or 1)))  # 0 disables
+PARALLEL_MIN_SENTENCES = int(os.environ.get("PIPER_PARALLEL_MIN_SENTENCES", 4))
+SENTENCE_SILENCE = float(os.environ.get("PIPER_SENTENCE_SILENCE", 0.0))  # seconds between sentences
+OPUS_BITRATE = int(os.environ.get("PIPER_OPUS_BITRATE", 32000))  # bits per second
 
-def load_models():
-    """Scan models directory for available ONNX files."""
+# Output formats: media type and file extension
+FORMATS = {
+    "wav": ("audio/wav", "wav"),
+    "pcm_s16le": ("application/octet-stream", "pcm"),  # rate in the X-Sample-Rate header
+    "ogg_opus": ("audio/ogg", "ogg"),
+}
+# Accept header media types understood for negotiation
+ACCEPT_FORMATS = {
+    "audio/wav": "wav", "audio/wave": "wav", "audio/x-wav": "wav",
+    "application/octet-stream": "pcm_s16le", "audio/pcm": "pcm_s16le",
+    "audio/ogg": "ogg_opus", "audio/opus": "ogg_opus",
+}
+CACHE_MEMORY_BYTES = int(os.environ.get("PIPER_CACHE_MEMORY_BYTES", 32 * 1024 * 1024))  # 0 disables
+CACHE_DIR = os.environ.get("PIPER_CACHE_DIR", os.path.join(tempfile.gettempdir(), "piper-cache"))
+CACHE_DISK_BYTES = int(os.environ.get("PIPER_CACHE_DISK_BYTES", 256 * 1024 * 1024))  # 0 disables
+# Admission control: syntheses running at once, requests allowed to wait for
+# a slot, and how long one may wait (X-Request-Timeout can only shorten it)
+MAX_CONCURRENT = int(os.environ.get("PIPER_MAX_CONCURRENT", SYNTH_WORKERS))
+MAX_QUEUE = int(os.environ.get("PIPER_MAX_QUEUE", 16))
+REQUEST_TIMEOUT = float(os.environ.get("PIPER_REQUEST_TIMEOUT", 10))  # seconds
+
+
+def model_mtime(model_path: str) -> float:
+    """Version of a voice file: its mtime, or 0 if it is missing."""
+    return os.path.getmtime(model_path) if os.path.exists(model_path) else 0
+
+
+class VoiceCache:
+    """
+    PiperVoice objects keyed by model path, loaded on first use and kept
+    until `max_voices` others have been used more recently. Each remembers
+    the model file's mtime, so a file replaced in place is reloaded on its
+    next use (worker processes have no other way to learn of it). Concurrent
+    first requests for the same voice wait for a single load.
+    """
+
+    def __init__(self, max_voices: int):
+        self.max_voices = max_voices
+        self.voices = OrderedDict()  # model path -> (mtime, PiperVoice)
+        self._loading = {}  # model path -> lock held while it loads
+        self._lock = threading.Lock()
+
+    def get(self, model_path: str, mtime: Optional[float] = None) -> PiperVoice:
+        if mtime is None:
+            mtime = model_mtime(model_path)
+        with self._lock:
+            entry = self.voices.get(model_path)
+            if entry is not None and entry[0] == mtime:
+                self.voices.move_to_end(model_path)
+                return entry[1]
+            loading = self._loading.setdefault(model_path, threading.Lock())
+
+        with loading:
+            with self._lock:
+                entry = self.voices.get(model_path)
+            if entry is not None and entry[0] == mtime:
+                return entry[1]
+            print(f"Loading voice: {model_path}")
+            voice = PiperVoice.load(model_path)
+            with self._lock:
+                self.voices[model_path] = (mtime, voice)
+                self.voices.move_to_end(model_path)
+                while len(self.voices) > self.max_voices:
+                    self.voices.popitem(last=False)
+                self._loading.pop(model_path, None)
+        return voice
+
+    def evict(self, model_path: str):
+        with self._lock:
+            if self.voices.pop(model_path, None) is not None:
+                print(f"Unloaded voice: {model_path}")
+
+    def loaded(self) -> list:
+        with self._lock:
+            return list(self.voices)
+
+
+class AudioCache:
+    """
+    Synthesized WAVs keyed by voice, normalized text and synthesis settings.
+
+    A memory LRU sits in front of a directory of WAV files, each tier bounded
+    by its byte budget. Disk hits are promoted to memory; the least recently
+    used files are deleted once the directory is over budget. The directory
+    is re-indexed on startup, so entries survive restarts.
+    """
+
+    def __init__(self, memory_bytes: int, disk_dir: str, disk_bytes: int):
+        self.memory_bytes = memory_bytes
+        self.memory = OrderedDict()  # key -> wav bytes
+        self.memory_used = 0
+        self.disk_dir = disk_dir if disk_bytes > 0 else ""
+        self.disk_bytes = disk_bytes
+        self.disk = OrderedDict()  # key -> file size
+        self.disk_used = 0
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        self._lock = threading.Lock()
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            entries = []
+            for filename in os.listdir(self.disk_dir):
+                if filename.endswith(".wav"):
+                    stat = os.stat(os.path.join(self.disk_dir, filename))
+                    entries.append((stat.st_mtime, filename[:-4], stat.st_size))
+            for _, key, size in sorted(entries):
+                self.disk[key] = size
+                self.disk_used += size
+
+    @staticmethod
+    def key(model_path: str, text: str, params: dict, mtime: Optional[float] = None) -> str:
+        # The model's mtime makes a replaced voice file miss instead of serving stale audio
+        if mtime is None:
+            mtime = model_mtime(model_path)
+        identity = json.dumps([model_path, mtime, text, params, SENTENCE_SILENCE], sort_keys=True)
+        return hashlib.sha256(identity.encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.wav")
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            wav = self.memory.get(key)
+            if wav is not None:
+                self.memory.move_to_end(key)
+                self.hits["memory"] += 1
+                return wav
+            on_disk = key in self.disk
+        if on_disk:
+            try:
+                with open(self._path(key), "rb") as f:
+                    wav = f.read()
+                os.utime(self._path(key))
+            except OSError:
+                wav = None
+        with self._lock:
+            if wav is None:
+                self._forget(key)
+                self.misses += 1
+                return None
+            if key in self.disk:
+                self.disk.move_to_end(key)
+            self.hits["disk"] += 1
+            self._remember(key, wav)
+            return wav
+
+    def put(self, key: str, wav: bytes):
+        with self._lock:
+            self._remember(key, wav)
+            if not self.disk_dir or len(wav) > self.disk_bytes or key in self.disk:
+                return
+        temp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(wav)
+            os.replace(temp_path, self._path(key))
+        except OSError as e:
+            print(f"Could not write TTS cache file: {e}")
+            return
+        with self._lock:
+            self._forget(key)  # a concurrent put of the same key may have counted it already
+            self.disk[key] = len(wav)
+            self.disk_used += len(wav)
+            while self.disk_used > self.disk_bytes and self.disk:
+                evicted, _ = next(iter(self.disk.items()))
+                self._forget(evicted)
+                try:
+                    os.remove(self._path(evicted))
+                except OSError:
+                    pass
+
+    def _remember(self, key: str, wav: bytes):
+        if len(wav) > self.memory_bytes or key in self.memory:
+            return
+        self.memory[key] = wav
+        self.memory_used += len(wav)
+        while self.memory_used > self.memory_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_used -= len(evicted)
+
+    def _forget(self, key: str):
+        size = self.disk.pop(key, None)
+        if size is not None:
+            self.disk_used -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": dict(self.hits),
+                "misses": self.misses,
+                "memory": {"entries": len(self.memory), "bytes": self.memory_used,
+                           "max_bytes": self.memory_bytes},
+                "disk": {"entries": len(self.disk), "bytes": self.disk_used,
+                         "max_bytes": self.disk_bytes if self.disk_dir else 0},
+            }
+
+
+class Overloaded(Exception):
+    """Raised when a synthesis cannot be admitted: queue full or deadline passed."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionControl:
+    """
+    Caps the syntheses running at once at `limit`. Further requests wait in
+    FIFO order, at most `max_queue` of them and each until its deadline;
+    beyond that they are turned away with Overloaded instead of piling onto
+    the CPU and slowing every request down. Used from the event loop only.
+    """
+
+    def __init__(self, limit: int, max_queue: int):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.waiters = deque()  # futures resolved when a slot is handed over
+        self.avg_job_time = 1.0
+        self.admitted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def retry_after(self) -> int:
+        """Rough number of seconds until a queued request would get a slot."""
+        backlog = len(self.waiters) + 1
+        return max(1, math.ceil(backlog * self.avg_job_time / self.limit))
+
+    async def acquire(self, timeout: float):
+        """Take a slot, waiting at most `timeout` seconds, or raise Overloaded."""
+        if self.in_flight < self.limit and not self.waiters:
+            self.in_flight += 1
+            self._admit(0.0)
+            return
+        if len(self.waiters) >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded("Synthesis queue is full", self.retry_after())
+        start = time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise Overloaded("Timed out waiting for a synthesis slot", self.retry_after())
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(0.0)  # handed a slot just as the request went away
+            raise
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+        self._admit(time.monotonic() - start)
+
+    def release(self, elapsed: float):
+        """Give the slot to the oldest waiter still waiting, or free it."""
+        if elapsed:
+            self.avg_job_time = 0.8 * self.avg_job_time + 0.2 * elapsed
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def _admit(self, wait: float):
+        self.admitted += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": len(self.waiters),
+            "limit": self.limit,
+            "max_queue": self.max_queue,
+            "avg_wait": round(self.total_wait / self.admitted, 3) if self.admitted else 0.0,
+            "max_wait": round(self.max_wait, 3),
+            "avg_job_time": round(self.avg_job_time, 3),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+
+voices = VoiceCache(VOICE_CACHE_SIZE)
+cache = AudioCache(CACHE_MEMORY_BYTES, CACHE_DIR, CACHE_DISK_BYTES)
+admission = AdmissionControl(MAX_CONCURRENT, MAX_QUEUE)
+# onnxruntime releases the GIL while it runs, so syntheses overlap on threads
+executor = concurrent.futures.ThreadPoolExecutor(SYNTH_WORKERS, thread_name_prefix="piper-synth")
+# Long texts are split into sentences rendered side by side in worker
+# processes, each holding its own VoiceCache. Spawned rather than forked so
+# no onnxruntime threads are copied; created at startup (see warm_worker).
+processes = None
+readiness = {"ready": False, "error": None}
+
+def scan_models() -> dict:
+    """Voices in the models directory: every .onnx with its .onnx.json config."""
+    models = {}
     if not os.path.exists(MODELS_DIR):
-        return
+        return models
     for filename in os.listdir(MODELS_DIR):
-        if filename.endswith(".onnx"):
-            model_name = filename[:-5] # remove .onnx
-            AVAILABLE_MODELS[model_name] = os.path.join(MODELS_DIR, filename)
-            print(f"Loaded model: {model_name}")
+        path = os.path.join(MODELS_DIR, filename)
+        if filename.endswith(".onnx") and os.path.exists(f"{path}.json"):
+            try:
+                models[filename[:-5]] = (path, os.path.getmtime(path))  # remove .onnx
+            except OSError:
+                continue  # removed while scanning
+    return models
+
+def build_voice_index(models: dict) -> dict:
+    """
+    Every name a request may use for a voice, precomputed so resolution is a
+    dict lookup. Names look like en_US-lessac-medium (language, speaker,
+    quality): exact names come first, then case-folded names and their
+    parts ("lessac", "en_us", "en", "lessac-medium", "medium"), then any
+    other substring, as the old partial match allowed. Ambiguous aliases go
+    to the alphabetically first voice.
+    """
+    index = {name: path for name, (path, _) in models.items()}
+    names = sorted(models)
+    for name in names:
+        lower = name.lower()
+        aliases = [lower]
+        parts = lower.split("-")
+        if len(parts) == 3:
+            language, speaker, quality = parts
+            aliases += [language, language.split("_")[0], speaker,
+                        f"{language}-{speaker}", f"{speaker}-{quality}", quality]
+        for alias in aliases:
+            index.setdefault(alias, models[name][0])
+    for name in names:
+        lower = name.lower()
+        for start in range(len(lower)):
+            for end in range(start + 1, len(lower) + 1):
+                index.setdefault(lower[start:end], models[name][0])
+    return index
+
+def load_models():
+    """Rescan the models directory, swapping in the new voice index if anything changed."""
+    global AVAILABLE_MODELS, VOICE_INDEX
+    models = scan_models()
+    if models == AVAILABLE_MODELS:
+        return
+    for name, (path, mtime) in AVAILABLE_MODELS.items():
+        if models.get(name) != (path, mtime):
+            voices.evict(path)  # removed or replaced: reload on next use
+    for name in models.keys() - AVAILABLE_MODELS.keys():
+        print(f"Loaded model: {name}")
+    for name in AVAILABLE_MODELS.keys() - models.keys():
+        print(f"Removed model: {name}")
+    # Rebinding (not mutating) keeps concurrent lookups consistent
+    VOICE_INDEX = build_voice_index(models)
+    AVAILABLE_MODELS = models
+
+async def watch_models():
+    """Poll the models directory so voices can be added or removed without a restart."""
+    while True:
+        await asyncio.sleep(MODELS_POLL_INTERVAL)
+        try:
+            await asyncio.to_thread(load_models)
+        except Exception as e:
+            print(f"Model rescan failed: {e}")
 
 class TTSRequest(BaseModel):
     text: str
     output_file: Optional[str] = None
     voice: Optional[str] = None
+    # Synthesis settings; unset ones use the voice's defaults
+    speaker_id: Optional[int] = None
+    length_scale: Optional[float] = None
+    noise_scale: Optional[float] = None
+    noise_w_scale: Optional[float] = None
+    volume: Optional[float] = None
+    # wav | pcm_s16le | ogg_opus; when unset the Accept header decides
+    format: Optional[str] = None
+
+    def synthesis_params(self) -> dict:
+        params = {
+            "speaker_id": self.speaker_id,
+            "length_scale": self.length_scale,
+            "noise_scale": self.noise_scale,
+            "noise_w_scale": self.noise_w_scale,
+            "volume": self.volume,
+        }
+        return {k: v for k, v in params.items() if v is not None}
 
 class TTSResponse(BaseModel):
     success: bool
     message: str
     audio_path: Optional[str] = None
 
+def preload_paths() -> list:
+    """Model paths to warm at startup: the default voice (if present) plus PIPER_PRELOAD_VOICES."""
+    paths = []
+    if os.path.exists(DEFAULT_MODEL_PATH):
+        paths.append(DEFAULT_MODEL_PATH)
+    else:
+        print(f"Not preloading missing default voice: {DEFAULT_MODEL_PATH}")
+    for name in PRELOAD_VOICES:
+        path = VOICE_INDEX.get(name) or VOICE_INDEX.get(name.lower())
+        if path is None:
+            print(f"Not preloading unknown voice: {name}")
+        elif path not in paths:
+            paths.append(path)
+    if len(paths) > VOICE_CACHE_SIZE:
+        print(f"Preloading {len(paths)} voices, but PIPER_VOICE_CACHE_SIZE keeps only {VOICE_CACHE_SIZE}")
+    return paths
+
+def warm_voice(model_path: str):
+    """Load a voice and run a short synthesis so the first real request skips ONNX warm-up."""
+    voice = voices.get(model_path)
+    for _ in voice.synthesize(WARMUP_TEXT):
+        pass
+
+def warm_worker(model_paths: list, warmed):
+    """Process pool initializer: every worker starts with the preloaded voices warm."""
+    for path in model_paths:
+        try:
+            warm_voice(path)
+        except Exception as e:
+            print(f"Worker could not preload {path}: {e}")
+    with warmed.get_lock():
+        warmed.value += 1
+
+async def warm_up(model_paths: list, warmed=None):
+    """
+    Warm the preloaded voices here and in every worker process, then mark
+    the server ready. A voice that fails to load is logged and skipped, as
+    in warm_worker; only having no voice at all to serve fails readiness.
+    """
+    start = time.monotonic()
+    print(f"Preloading {len(model_paths)} voice(s)...")
+    loop = asyncio.get_running_loop()
+    try:
+        for path in model_paths:
+            try:
+                await loop.run_in_executor(executor, warm_voice, path)
+            except Exception as e:
+                print(f"Could not preload {path}: {e}")
+        if not voices.loaded() and not AVAILABLE_MODELS:
+            raise RuntimeError(f"No voices found in {MODELS_DIR} and {DEFAULT_MODEL_PATH} could not be loaded")
+        if processes is not None:
+            # Each job submitted while no worker is idle spawns one, but the
+            # first worker up may run them all: wait for every initializer
+            jobs = [loop.run_in_executor(processes, os.getpid) for _ in range(SYNTH_PROCESSES)]
+            while warmed.value < SYNTH_PROCESSES:
+                done = [job for job in jobs if job.done()]
+                for job in done:
+                    job.result()  # raises BrokenProcessPool if a worker died
+                await asyncio.sleep(0.1)
+            await asyncio.gather(*jobs)
+    except Exception as e:
+        readiness["error"] = str(e)
+        print(f"Failed to preload voices: {e}")
+        return
+    readiness["ready"] = True
+    print(f"Voices loaded and warmed up in {time.monotonic() - start:.1f}s")
+
 @app.on_event("startup")
 async def startup_event():
+    global processes
     load_models()
+    paths = preload_paths()
+    warmed = None
+    if SYNTH_PROCESSES > 0:
+        context = multiprocessing.get_context("spawn")
+        warmed = context.Value("i", 0)  # workers done running warm_worker
+        processes = concurrent.futures.ProcessPoolExecutor(
+            SYNTH_PROCESSES,
+            mp_context=context,
+            initializer=warm_worker,
+            initargs=(paths, warmed)
+        )
+    app.state.warmer = asyncio.create_task(warm_up(paths, warmed))
+    if MODELS_POLL_INTERVAL > 0:
+        app.state.watcher = asyncio.create_task(watch_models())
+
+def resolve_voice(voice: Optional[str]) -> str:
+    """Model path for a requested voice name or alias (see build_voice_index)."""
+    if voice:
+        index = VOICE_INDEX
+        path = index.get(voice) or index.get(voice.lower())
+        if path:
+            return path
+    return DEFAULT_MODEL_PATH
+
+def wav_header(sample_rate: int, data_size: int = 0xFFFFFFFF) -> bytes:
+    """44-byte header for 16-bit mono PCM; the default size marks a stream of unknown length."""
+    riff_size = min(data_size + 36, 0xFFFFFFFF)
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", riff_size, b"WAVE",
+        b"fmt ", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+        b"data", data_size
+    )
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split())
+
+def silence(sample_rate: int) -> bytes:
+    return b"\0\0" * int(sample_rate * SENTENCE_SILENCE)
+
+def negotiate_format(requested: Optional[str], accept: str) -> str:
+    """Output format from the request field, else the first known Accept type, else wav."""
+    if requested is None:
+        for media_type in accept.split(","):
+            requested = ACCEPT_FORMATS.get(media_type.split(";")[0].strip().lower())
+            if requested:
+                break
+        else:
+            return "wav"
+    if requested not in FORMATS:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown format '{requested}', expected one of {sorted(FORMATS)}"
+        )
+    if requested == "ogg_opus" and av is None:
+        raise HTTPException(status_code=400, detail="ogg_opus output requires PyAV (pip install av)")
+    return requested
+
+def encode_opus(pcm: bytes, sample_rate: int) -> bytes:
+    """Ogg Opus at OPUS_BITRATE; PyAV resamples to Opus's 48 kHz."""
+    buffer = io.BytesIO()
+    with av.open(buffer, "w", format="ogg") as container:
+        stream = container.add_stream("libopus", rate=48000, layout="mono")
+        stream.bit_rate = OPUS_BITRATE
+        frame = av.AudioFrame.from_ndarray(
+            np.frombuffer(pcm, dtype="<i2").reshape(1, -1), format="s16", layout="mono"
+        )
+        frame.sample_rate = sample_rate
+        for packet in stream.encode(frame):
+            container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return buffer.getvalue()
+
+def encode_audio(wav: bytes, fmt: str) -> bytes:
+    """Convert a cached 44-byte-header WAV to the output format."""
+    if fmt == "pcm_s16le":
+        return wav[44:]
+    if fmt == "ogg_opus":
+        sample_rate, = struct.unpack_from("<I", wav, 24)
+        return encode_opus(wav[44:], sample_rate)
+    return wav
+
+async def audio_response(wav: bytes, fmt: str, background: Optional[BackgroundTask] = None) -> Response:
+    media_type, extension = FORMATS[fmt]
+    headers = {"Content-Disposition": f'attachment; filename="speech.{extension}"'}
+    if fmt == "pcm_s16le":
+        headers["X-Sample-Rate"] = str(struct.unpack_from("<I", wav, 24)[0])
+    if fmt != "wav":
+        audio = await asyncio.to_thread(encode_audio, wav, fmt)
+    else:
+        audio = wav
+    return Response(audio, media_type=media_type, headers=headers, background=background)
+
+def sentence_phonemes(model_path: str, mtime: float, text: str) -> list:
+    """Phonemes of each sentence, split by the voice's own phonemizer as synthesize() does."""
+    voice = voices.get(model_path, mtime)
+    return [phonemes for phonemes in voice.phonemize(text) if phonemes]
+
+def render_sentence(model_path: str, mtime: float, phonemes: list, params: dict) -> tuple:
+    """
+    One sentence from its phonemes, post-processed like each chunk of
+    PiperVoice.synthesize(); returns (sample rate, PCM). Runs in a worker process.
+    """
+    voice = voices.get(model_path, mtime)
+    config = SynthesisConfig(**params)
+    phoneme_ids = voice.phonemes_to_ids(phonemes)
+    audio = voice.phoneme_ids_to_audio(phoneme_ids, config)
+    if config.normalize_audio:
+        peak = np.max(np.abs(audio))
+        audio = audio / peak if peak >= 1e-8 else np.zeros_like(audio)
+    if config.volume != 1.0:
+        audio = audio * config.volume
+    chunk = AudioChunk(
+        sample_rate=voice.config.sample_rate, sample_width=2, sample_channels=1,
+        audio_float_array=np.clip(audio, -1.0, 1.0).astype(np.float32),
+        phonemes=phonemes, phoneme_ids=phoneme_ids
+    )
+    return voice.config.sample_rate, chunk.audio_int16_bytes
+
+def render_sentences(model_path: str, mtime: float, sentences: list, params: dict) -> tuple:
+    """Render phonemized sentences one after another; returns (sample rate, PCM). Runs on the thread pool."""
+    sample_rate = voices.get(model_path, mtime).config.sample_rate
+    parts = [render_sentence(model_path, mtime, phonemes, params)[1] for phonemes in sentences]
+    return sample_rate, silence(sample_rate).join(parts)
+
+async def admit(http_request: Request):
+    """Wait for a synthesis slot within the request's deadline, or answer 503."""
+    timeout = REQUEST_TIMEOUT
+    header = http_request.headers.get("x-request-timeout")
+    if header is not None:
+        try:
+            timeout = min(timeout, max(0.0, float(header)))
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid X-Request-Timeout: {header}")
+    try:
+        await admission.acquire(timeout)
+    except Overloaded as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+async def synthesize_wav(model_path: str, mtime: float, text: str, params: dict) -> bytes:
+    """
+    WAV bytes for text, built in memory. Texts of PARALLEL_MIN_SENTENCES or
+    more sentences are rendered sentence by sentence across the process pool
+    and joined in order; shorter ones run on the thread pool. Sentences are
+    the phonemizer's, which Piper renders one by one anyway, so both paths
+    produce the same audio, and the text is phonemized only once.
+    """
+    loop = asyncio.get_running_loop()
+    sentences = await loop.run_in_executor(executor, sentence_phonemes, model_path, mtime, text)
+    if processes is None or len(sentences) < PARALLEL_MIN_SENTENCES:
+        results = [await loop.run_in_executor(executor, render_sentences, model_path, mtime, sentences, params)]
+    else:
+        results = await asyncio.gather(*(
+            loop.run_in_executor(processes, render_sentence, model_path, mtime, phonemes, params)
+            for phonemes in sentences
+        ))
+    sample_rate = results[0][0]
+    pcm = silence(sample_rate).join(part for _, part in results if part)
+    return wav_header(sample_rate, len(pcm)) + pcm
 
 @app.post("/synthesize")
-async def synthesize_speech(request: TTSRequest):
+async def synthesize_speech(request: TTSRequest, http_request: Request):
     """
     Convert text to speech using Piper TTS.
-    Returns audio file directly.
+    Returns the audio directly, built in memory: WAV by default, or
+    pcm_s16le / ogg_opus chosen by the `format` field or the Accept header.
     """
     if not request.text or len(request.text.strip()) == 0:
         raise HTTPException(status_code=400, detail="Text cannot be empty")
-    
-    # Select Model
-    model_path = DEFAULT_MODEL_PATH
-    if request.voice:
-        # 1. Exact match
-        if request.voice in AVAILABLE_MODELS:
-            model_path = AVAILABLE_MODELS[request.voice]
-        else:
-            # 2. Partial match
-            for name, path in AVAILABLE_MODELS.items():
-                if request.voice.lower() in name.lower():
-                    model_path = path
-                    break
-    
+    fmt = negotiate_format(request.format, http_request.headers.get("accept", ""))
+
+    model_path = resolve_voice(request.voice)
+    text = normalize_text(request.text)
+    params = request.synthesis_params()
+    mtime = model_mtime(model_path)
+    cache_key = AudioCache.key(model_path, text, params, mtime)
+    wav = await asyncio.to_thread(cache.get, cache_key)
+    if wav is not None:
+        return await audio_response(wav, fmt)
+
+    await admit(http_request)
+    start = time.monotonic()
     try:
-        # Create a temporary file for the output
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
-            output_path = tmp.name
-        
-        # Run piper
-        process = subprocess.run(
-            [
-                PIPER_CMD,
-                "--model", model_path,
-                "--output_file", output_path
-            ],
-            input=request.text,
-            capture_output=True,
-            text=True
-        )
-        
-        if process.returncode != 0:
-            raise Exception(f"Piper failed: {process.stderr}")
-        
-        # Read the audio file and return it
-        from fastapi.responses import FileResponse
-        return FileResponse(
-            output_path,
-            media_type="audio/wav",
-            filename="speech.wav"
-        )
-        
+        wav = await synthesize_wav(model_path, mtime, text, params)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        admission.release(time.monotonic() - start)
+
+    # Cache once the response is sent, keeping the disk write off the hot path
+    return await audio_response(wav, fmt, background=BackgroundTask(cache.put, cache_key, wav))
+
+@app.post("/synthesize/stream")
+async def synthesize_stream(request: TTSRequest, http_request: Request):
+    """
+    Convert text to speech, streaming the audio as it is generated.
+    Returns a chunked WAV: a header of unknown length first, then the PCM of
+    each sentence as soon as it is synthesized (Piper splits the text into
+    sentences and renders them in order), so playback can start early.
+    With format pcm_s16le the header is left out.
+    """
+    if not request.text or len(request.text.strip()) == 0:
+        raise HTTPException(status_code=400, detail="Text cannot be empty")
+    fmt = negotiate_format(request.format, http_request.headers.get("accept", ""))
+    if fmt == "ogg_opus":
+        raise HTTPException(status_code=400, detail="Streaming supports wav and pcm_s16le only")
+
+    model_path = resolve_voice(request.voice)
+    text = normalize_text(request.text)
+    params = request.synthesis_params()
+    mtime = model_mtime(model_path)
+    cache_key = AudioCache.key(model_path, text, params, mtime)
+    wav = await asyncio.to_thread(cache.get, cache_key)
+    if wav is not None:
+        return await audio_response(wav, fmt)
+
+    await admit(http_request)
+    start = time.monotonic()
+    loop = asyncio.get_running_loop()
+    try:
+        voice = await loop.run_in_executor(executor, voices.get, model_path, mtime)
+    except Exception as e:
+        admission.release(time.monotonic() - start)
+        raise HTTPException(status_code=500, detail=str(e))
+    except asyncio.CancelledError:
+        admission.release(time.monotonic() - start)
+        raise
+
+    chunks = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def produce():
+        for chunk in voice.synthesize(text, SynthesisConfig(**params)):
+            if cancelled.is_set():
+                break
+            loop.call_soon_threadsafe(chunks.put_nowait, chunk.audio_int16_bytes)
+
+    def finished(_):
+        # The slot is held until synthesis ends, whether or not the body was read
+        admission.release(time.monotonic() - start)
+        chunks.put_nowait(None)
+
+    job = loop.run_in_executor(executor, produce)
+    job.add_done_callback(finished)
+
+    async def body():
+        pieces = []
+        gap = silence(voice.config.sample_rate)
+        try:
+            if fmt == "wav":
+                yield wav_header(voice.config.sample_rate)
+            while (pcm := await chunks.get()) is not None:
+                if pieces and gap:
+                    yield gap
+                pieces.append(pcm)
+                yield pcm
+            await job  # re-raise a synthesis failure instead of ending cleanly
+            pcm = gap.join(pieces)
+            await asyncio.to_thread(
+                cache.put, cache_key, wav_header(voice.config.sample_rate, len(pcm)) + pcm
+            )
+        finally:
+            # Client gone: stop after the sentence in progress
+            cancelled.set()
+
+    return StreamingResponse(
+        body(),
+        media_type=FORMATS[fmt][0],
+        headers={"X-Sample-Rate": str(voice.config.sample_rate)} if fmt == "pcm_s16le" else None
+    )
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: 200 once the preloaded voices are loaded and warmed up."""
+    if readiness["ready"]:
+        return {"status": "ready", "loaded_voices": voices.loaded()}
+    status = "failed" if readiness["error"] else "loading"
+    return JSONResponse(status_code=503, content={"status": status, "error": readiness["error"]})
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint."""
+    """Liveness check; see /ready for voice readiness."""
     return {
-        "status": "healthy", 
+        "status": "healthy",
+        "ready": readiness["ready"],
         "default_model": DEFAULT_MODEL_PATH,
-        "available_models": list(AVAILABLE_MODELS.keys())
+        "available_models": list(AVAILABLE_MODELS.keys()),
+        "loaded_voices": voices.loaded(),
+        "processes": SYNTH_PROCESSES,
+        "admission": admission.stats(),
+        "cache": cache.stats()
     }
 
 @app.get("/")
@@ -124,8 +828,10 @@ async def root():
         "service": "Piper TTS Server",
         "version": "1.0.0",
         "endpoints": {
-            "POST /synthesize": "Convert text to speech",
-            "GET /health": "Health check",
+            "POST /synthesize": "Convert text to speech (format: wav | pcm_s16le | ogg_opus)",
+            "POST /synthesize/stream": "Convert text to speech, streaming WAV sentence by sentence",
+            "GET /health": "Liveness check",
+            "GET /ready": "Readiness check (preloaded voices warmed up)",
             "GET /": "This documentation"
         }
     }
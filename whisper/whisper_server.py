@@ -3,16 +3,45 @@
 Whisper STT Server - FastAPI-based transcription service
 """
 
-import tempfile
+import argparse
+import asyncio
+import bisect
+import concurrent.futures
+import functools
+import hashlib
+import io
+import json
+import math
+import socket
+import struct
+import subprocess
+import threading
+import time
+import types
 import os
-from faster_whisper import WhisperModel
-from fastapi import FastAPI, HTTPException, UploadFile, File
-from fastapi.responses import JSONResponse
+import re
+import urllib.request
+import uuid
+import wave
+import weakref
+import numpy as np
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from faster_whisper import BatchedInferencePipeline, WhisperModel, decode_audio
+from faster_whisper.transcribe import Segment, Word
+from faster_whisper.vad import VadOptions, get_speech_timestamps
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
 
+try:
+    import soxr
+except ImportError:  # optional: resample() falls back to linear interpolation
+    soxr = None
+
 app = FastAPI(title="Whisper STT Server")
 
 # Add CORS middleware
@@ -25,69 +54,1576 @@ app.add_middleware(
 )
 
 # Configuration
+BACKENDS = ("faster-whisper", "whisper.cpp")
+BACKEND = os.environ.get("WHISPER_BACKEND", "faster-whisper")
+if BACKEND not in BACKENDS:
+    raise RuntimeError(f"Unknown WHISPER_BACKEND '{BACKEND}', expected one of {BACKENDS}")
+WHISPER_CPP_SERVER = os.environ.get("WHISPER_CPP_SERVER", "whisper-server")  # examples/server binary
+WHISPER_CPP_MODEL_DIR = os.environ.get("WHISPER_CPP_MODEL_DIR", "/models")  # ggml-<model>[-<quant>].bin
+WHISPER_CPP_START_TIMEOUT = 120.0  # seconds for a server process to load its model
+WHISPER_CPP_REQUEST_TIMEOUT = 300.0  # seconds for one transcription before the replica is given up
 MODEL_SIZE = os.environ.get("WHISPER_MODEL_SIZE", "base")
 DEVICE = os.environ.get("WHISPER_DEVICE", "cpu")
 COMPUTE_TYPE = os.environ.get("WHISPER_COMPUTE_TYPE", "int8")
+WORKERS = int(os.environ.get("WHISPER_WORKERS", 2))
+CPU_THREADS = int(os.environ.get("WHISPER_CPU_THREADS", 0))  # per replica; 0 = backend default
+TUNING_FILE = os.environ.get("WHISPER_TUNING_FILE", "whisper_tuning.json")  # empty disables
+TARGET_RTF = float(os.environ.get("WHISPER_TARGET_RTF", 0.5))
+
+
+def _load_tuning(path: str) -> Optional[dict]:
+    """Settings written by --autotune, if they were measured for this model and host."""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            tuning = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable tuning file {path}: {e}")
+        return None
+    if (tuning.get("model"), tuning.get("device"), tuning.get("cpu_count")) != (
+        MODEL_SIZE, DEVICE, os.cpu_count()
+    ):
+        print(f"Ignoring tuning file {path}: measured for a different model or host")
+        return None
+    return tuning
+
+
+# Autotuned settings take precedence over the env defaults above
+TUNING = _load_tuning(TUNING_FILE) if BACKEND == "faster-whisper" else None
+if TUNING:
+    COMPUTE_TYPE = TUNING["compute_type"]
+    CPU_THREADS = TUNING["cpu_threads"]
+    WORKERS = TUNING["workers"]
+    print(f"Using tuned settings from {TUNING_FILE}: compute_type={COMPUTE_TYPE}, "
+          f"cpu_threads={CPU_THREADS}, workers={WORKERS}")
+QUEUE_SIZE = int(os.environ.get("WHISPER_QUEUE_SIZE", 8))
+BULK_QUEUE_SIZE = int(os.environ.get("WHISPER_BULK_QUEUE_SIZE", 32))
+INTERACTIVE_MAX_SECONDS = float(os.environ.get("WHISPER_INTERACTIVE_MAX_SECONDS", 30))  # longer uploads are bulk
+INTERACTIVE_BURST = int(os.environ.get("WHISPER_INTERACTIVE_BURST", 8))  # then one waiting bulk job runs
+INTERACTIVE, BULK = "interactive", "bulk"
+SAMPLE_RATE = 16000  # Whisper's native input rate
+STREAM_STEP = float(os.environ.get("WHISPER_STREAM_STEP", 1.0))  # seconds of new audio per decode
+STREAM_WINDOW = float(os.environ.get("WHISPER_STREAM_WINDOW", 15.0))  # seconds kept before trimming
+STREAM_MAX_WINDOW = 28.0  # hard cap, just under Whisper's 30 s context
+BATCH_MAX_SIZE = int(os.environ.get("WHISPER_BATCH_MAX_SIZE", 8))  # 1 disables batching
+if BACKEND == "whisper.cpp":
+    BATCH_MAX_SIZE = 1  # no batched pipeline: clips queue for the server processes instead
+BATCH_MAX_WAIT_MS = float(os.environ.get("WHISPER_BATCH_MAX_WAIT_MS", 10))
+BATCH_MAX_SECONDS = 30.0  # only clips that fit one Whisper window are batched
+REALTIME_LANGUAGE = os.environ.get("WHISPER_REALTIME_LANGUAGE", "en")
+DEFAULT_PROFILE = os.environ.get("WHISPER_DEFAULT_PROFILE", "accurate")
+
+# Named decode settings, passed straight to WhisperModel.transcribe
+PROFILES = {
+    # Greedy, no temperature fallback, language pinned to skip detection
+    "realtime": {
+        "beam_size": 1,
+        "temperature": 0.0,
+        "language": REALTIME_LANGUAGE,
+        "vad_filter": False,
+        "without_timestamps": True,
+        "condition_on_previous_text": False,
+    },
+    # The original behaviour: beam search with language detection
+    "accurate": {
+        "beam_size": 5,
+        "language": None,
+        "vad_filter": False,
+        "without_timestamps": False,
+    },
+}
+FANOUT_CONCURRENCY = int(os.environ.get("WHISPER_FANOUT_CONCURRENCY", max(WORKERS, BATCH_MAX_SIZE)))
+BATCH_MAX_FILES = int(os.environ.get("WHISPER_BATCH_MAX_FILES", 256))
+BATCH_BUSY_RETRIES = 3  # a batch item that hits a full queue waits Retry-After and tries again
+SPLIT_MIN_SECONDS = float(os.environ.get("WHISPER_SPLIT_MIN_SECONDS", 120))  # 0 disables splitting
+SPLIT_CHUNK_SECONDS = float(os.environ.get("WHISPER_SPLIT_CHUNK_SECONDS", 30))
+CACHE_MAX_BYTES = int(os.environ.get("WHISPER_CACHE_MAX_BYTES", 16 * 1024 * 1024))  # 0 disables
+SESSION_MAX = int(os.environ.get("WHISPER_SESSION_MAX", 1024))
+SESSION_TTL = float(os.environ.get("WHISPER_SESSION_TTL", 300))  # seconds since a session's last clip
+SESSION_PROMPT_CHARS = int(os.environ.get("WHISPER_SESSION_PROMPT_CHARS", 200))
+
+# Model registry: which models requests may pick, and how much memory they share
+SERVED_MODELS = {
+    name.strip()
+    for name in os.environ.get("WHISPER_MODELS", "tiny,base,small").split(",")
+    if name.strip()
+} | {MODEL_SIZE}
+COMPUTE_TYPES = {"default", "auto", "int8", "int8_float32", "int8_float16", "int8_bfloat16",
+                 "int16", "float16", "bfloat16", "float32"}
+# whisper.cpp picks the ggml file instead: "default" is the f16 model, the rest quantized ones
+GGML_QUANTIZATIONS = {"default": "", "int8": "-q8_0", "q8_0": "-q8_0", "q5_1": "-q5_1",
+                      "q5_0": "-q5_0", "q4_1": "-q4_1", "q4_0": "-q4_0"}
+if BACKEND == "whisper.cpp":
+    COMPUTE_TYPES = set(GGML_QUANTIZATIONS)
+MODEL_MEMORY_MB = int(os.environ.get("WHISPER_MODEL_MEMORY_MB", 2048))
+MODEL_IDLE_TIMEOUT = float(os.environ.get("WHISPER_MODEL_IDLE_TIMEOUT", 600))  # seconds
+
+# Approximate resident size of one int8 replica, in MB
+MODEL_FOOTPRINT_MB = {
+    "tiny": 75, "tiny.en": 75,
+    "base": 145, "base.en": 145,
+    "small": 480, "small.en": 480, "distil-small.en": 400,
+    "medium": 1500, "medium.en": 1500, "distil-medium.en": 900,
+    "large-v1": 3100, "large-v2": 3100, "large-v3": 3100, "large": 3100,
+    "distil-large-v2": 1600, "distil-large-v3": 1600, "large-v3-turbo": 1700, "turbo": 1700,
+}
+
+
+class PoolBusy(Exception):
+    """Raised when the transcription queue is full."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Transcription queue is full")
+        self.retry_after = retry_after
+
+
+# whisper.cpp reports languages by name; map them back to the codes faster-whisper uses
+WHISPER_CPP_LANGUAGES = {
+    "english": "en", "chinese": "zh", "german": "de", "spanish": "es", "russian": "ru",
+    "korean": "ko", "french": "fr", "japanese": "ja", "portuguese": "pt", "turkish": "tr",
+    "polish": "pl", "catalan": "ca", "dutch": "nl", "arabic": "ar", "swedish": "sv",
+    "italian": "it", "indonesian": "id", "hindi": "hi", "finnish": "fi", "vietnamese": "vi",
+    "hebrew": "he", "ukrainian": "uk", "greek": "el", "malay": "ms", "czech": "cs",
+    "romanian": "ro", "danish": "da", "hungarian": "hu", "tamil": "ta", "norwegian": "no",
+    "thai": "th", "urdu": "ur", "croatian": "hr", "bulgarian": "bg", "lithuanian": "lt",
+    "latin": "la", "maori": "mi", "malayalam": "ml", "welsh": "cy", "slovak": "sk",
+    "telugu": "te", "persian": "fa", "latvian": "lv", "bengali": "bn", "serbian": "sr",
+    "azerbaijani": "az", "slovenian": "sl", "kannada": "kn", "estonian": "et", "macedonian": "mk",
+    "breton": "br", "basque": "eu", "icelandic": "is", "armenian": "hy", "nepali": "ne",
+    "mongolian": "mn", "bosnian": "bs", "kazakh": "kk", "albanian": "sq", "swahili": "sw",
+    "galician": "gl", "marathi": "mr", "punjabi": "pa", "sinhala": "si", "khmer": "km",
+    "shona": "sn", "yoruba": "yo", "somali": "so", "afrikaans": "af", "occitan": "oc",
+    "georgian": "ka", "belarusian": "be", "tajik": "tg", "sindhi": "sd", "gujarati": "gu",
+    "amharic": "am", "yiddish": "yi", "lao": "lo", "uzbek": "uz", "faroese": "fo",
+    "haitian creole": "ht", "pashto": "ps", "turkmen": "tk", "nynorsk": "nn", "maltese": "mt",
+    "sanskrit": "sa", "luxembourgish": "lb", "myanmar": "my", "tibetan": "bo", "tagalog": "tl",
+    "malagasy": "mg", "assamese": "as", "tatar": "tt", "hawaiian": "haw", "lingala": "ln",
+    "hausa": "ha", "bashkir": "ba", "javanese": "jw", "sundanese": "su", "cantonese": "yue",
+}
+
+
+def _footprint_mb(name: str, compute_type: str) -> int:
+    base = MODEL_FOOTPRINT_MB.get(name, 1500)
+    if compute_type.startswith(("int8", "q")) or compute_type in ("default", "auto"):
+        return base
+    if compute_type == "float32":
+        return base * 4
+    return base * 2
+
+
+class WhisperCppModel:
+    """
+    A warm whisper.cpp server subprocess behind the WhisperModel.transcribe()
+    interface, so the registry, workers and endpoints use it unchanged. The
+    server decodes one request at a time, so each replica is its own process;
+    it is terminated when the replica is dropped, and a replica whose process
+    has died reports `alive` False so the registry replaces it. Languages are
+    reported as codes ("en"), like faster-whisper.
+    """
+
+    def __init__(self, name: str, compute_type: str, threads: int = 0):
+        path = os.path.join(WHISPER_CPP_MODEL_DIR, f"ggml-{name}{GGML_QUANTIZATIONS[compute_type]}.bin")
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"whisper.cpp model not found: {path}")
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        # -nlp: verbose_json would otherwise run a second encoder pass per
+        # request just to report the language probability
+        command = [WHISPER_CPP_SERVER, "-m", path, "--host", "127.0.0.1", "--port", str(port), "-nlp"]
+        if threads > 0:
+            command += ["-t", str(threads)]
+        self.url = f"http://127.0.0.1:{port}"
+        self.process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+        self.close = weakref.finalize(self, self._stop, self.process)
+        try:
+            self._wait_ready()
+        except Exception:
+            self.close()
+            raise
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    @staticmethod
+    def _stop(process: subprocess.Popen):
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    def _wait_ready(self):
+        deadline = time.monotonic() + WHISPER_CPP_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"whisper.cpp server exited with code {self.process.returncode}")
+            try:
+                with urllib.request.urlopen(f"{self.url}/health", timeout=1):
+                    return
+            except OSError:  # not listening yet, or 503 while the model loads
+                time.sleep(0.2)
+        raise RuntimeError(f"whisper.cpp server not ready after {WHISPER_CPP_START_TIMEOUT:.0f}s")
+
+    @staticmethod
+    def _wav(audio: np.ndarray) -> bytes:
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as out:
+            out.setnchannels(1)
+            out.setsampwidth(2)
+            out.setframerate(SAMPLE_RATE)
+            out.writeframes((np.clip(audio, -1.0, 1.0) * 32767).astype("<i2").tobytes())
+        return buffer.getvalue()
+
+    def _inference(self, audio: np.ndarray, fields: dict) -> dict:
+        if not self.alive:
+            raise RuntimeError(f"whisper.cpp server exited with code {self.process.returncode}")
+        boundary = uuid.uuid4().hex
+        body = b"".join(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+            for name, value in fields.items()
+        )
+        body += (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="audio.wav"\r\n'
+            f"Content-Type: audio/wav\r\n\r\n"
+        ).encode() + self._wav(audio) + f"\r\n--{boundary}--\r\n".encode()
+        request = urllib.request.Request(
+            f"{self.url}/inference",
+            data=body,
+            headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=WHISPER_CPP_REQUEST_TIMEOUT) as response:
+                return json.load(response)
+        except TimeoutError:
+            self.close()  # a hung server never answers again; drop the replica
+            raise RuntimeError(f"whisper.cpp server did not answer within {WHISPER_CPP_REQUEST_TIMEOUT:.0f}s")
+
+    @staticmethod
+    def _words(tokens: list) -> list:
+        """Join whisper.cpp's per-token timings into words (a word starts with a space)."""
+        words = []
+        for token in tokens:
+            text = token["word"]
+            if words and not text.startswith(" "):
+                last = words[-1]
+                words[-1] = Word(last.start, token.get("end", last.end), last.word + text,
+                                 min(last.probability, token["probability"]))
+            else:
+                words.append(Word(token.get("start", 0.0), token.get("end", 0.0), text, token["probability"]))
+        return words
+
+    def transcribe(self, audio, language=None, beam_size=5, temperature=None, initial_prompt=None,
+                   without_timestamps=False, word_timestamps=False, **_):
+        """
+        Same return shape as WhisperModel.transcribe. Options without a
+        whisper.cpp equivalent (vad_filter, condition_on_previous_text) are
+        ignored; whisper.cpp never conditions on its previous text here.
+        """
+        fields = {
+            "response_format": "verbose_json",
+            "language": language or "auto",
+            "beam_size": beam_size,
+            "no_timestamps": "true" if without_timestamps and not word_timestamps else "false",
+        }
+        if initial_prompt:
+            fields["prompt"] = initial_prompt
+        if isinstance(temperature, (int, float)):
+            fields["temperature"] = temperature
+            fields["temperature_inc"] = 0  # a single temperature means no fallback
+        result = self._inference(audio, fields)
+
+        duration = result["duration"]
+        segments = [
+            Segment(
+                id=index,
+                seek=0,
+                start=segment.get("start", 0.0),
+                end=segment.get("end", duration),
+                text=segment["text"],
+                tokens=segment.get("tokens", []),
+                avg_logprob=segment.get("avg_logprob", 0.0),
+                compression_ratio=0.0,  # not reported by whisper.cpp
+                no_speech_prob=segment.get("no_speech_prob", 0.0),
+                words=self._words(segment.get("words", [])) if word_timestamps else None,
+                temperature=segment.get("temperature"),
+            )
+            for index, segment in enumerate(result["segments"])
+        ]
+        info = types.SimpleNamespace(
+            language=WHISPER_CPP_LANGUAGES.get(result["language"], result["language"]),
+            language_probability=result.get("detected_language_probability"),
+            duration=duration,
+        )
+        return iter(segments), info
+
+
+class ModelRegistry:
+    """
+    Model replicas keyed by (model, compute_type), loaded on first use.
+
+    Every model keeps up to `max_replicas` replicas (one per worker), fewer
+    if the memory budget cannot hold that many, and all of them share the
+    budget: loading a new replica first evicts idle replicas of the least
+    recently used other models. Models nobody has used
+    for `idle_timeout` seconds are unloaded by evict_idle(); the default model
+    is exempt from that.
+    """
+
+    def __init__(self, budget_mb: int, idle_timeout: float, max_replicas: int, pinned: tuple):
+        self.budget_mb = budget_mb
+        self.idle_timeout = idle_timeout
+        self.max_replicas = max_replicas
+        self.pinned = pinned
+        self.entries = OrderedDict()  # key -> {"idle": [...], "total", "in_use", "last_used"}
+        self.used_mb = 0
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def _load(key):
+        name, compute_type = key
+        print(f"Loading Whisper model ({name}, {compute_type}) with {BACKEND} on {DEVICE}...")
+        if BACKEND == "whisper.cpp":
+            return WhisperCppModel(name, compute_type, threads=CPU_THREADS)
+        return WhisperModel(name, device=DEVICE, compute_type=compute_type, cpu_threads=CPU_THREADS)
+
+    def preload(self, key, replicas: int, warmup=None):
+        """
+        Load `replicas` replicas of `key` up front (as many as the budget
+        holds), running warmup(model) on each. Each is returned before the
+        next loads, so the budget is never waited on by its own holder.
+        """
+        count = min(replicas, self.max_replicas, max(1, self.budget_mb // _footprint_mb(*key)))
+        if count < replicas:
+            print(f"Memory budget of {self.budget_mb} MB holds only {count} replica(s) of {key[0]}")
+        for _ in range(count):
+            with self.acquire(key, fresh=True) as model:
+                if warmup is not None:
+                    warmup(model)
+
+    @contextmanager
+    def acquire(self, key, fresh: bool = False):
+        """Borrow a replica of `key`, loading one if none is free (or, if fresh, while under the limit)."""
+        model = self._checkout(key, fresh)
+        try:
+            yield model
+        finally:
+            with self._cond:
+                entry = self.entries[key]
+                if getattr(model, "alive", True):
+                    entry["idle"].append(model)
+                else:
+                    self._discard(key, entry, model)
+                entry["in_use"] -= 1
+                entry["last_used"] = time.monotonic()
+                self._cond.notify_all()
+
+    def _checkout(self, key, fresh: bool = False):
+        cost = _footprint_mb(*key)
+        if cost > self.budget_mb:
+            raise RuntimeError(
+                f"Model {key[0]} ({key[1]}) needs ~{cost} MB, over the {self.budget_mb} MB budget"
+            )
+        # Replicas beyond what the budget holds could only wait on each other
+        limit = min(self.max_replicas, self.budget_mb // cost)
+        with self._cond:
+            while True:
+                entry = self.entries.setdefault(
+                    key, {"idle": [], "total": 0, "in_use": 0, "last_used": time.monotonic()}
+                )
+                self.entries.move_to_end(key)
+                if entry["idle"] and not (fresh and entry["total"] < limit):
+                    model = entry["idle"].pop()
+                    if not getattr(model, "alive", True):  # died while idle
+                        self._discard(key, entry, model)
+                        continue
+                    entry["in_use"] += 1
+                    return model
+                if entry["total"] < limit and self._make_room(key, cost):
+                    entry["total"] += 1
+                    entry["in_use"] += 1
+                    self.used_mb += cost
+                    break
+                if not any(other["in_use"] for other in self.entries.values()):
+                    # Nothing will be returned to wake us up
+                    raise RuntimeError(
+                        f"No room for model {key[0]} ({key[1]}) in the {self.budget_mb} MB budget"
+                    )
+                self._cond.wait()
+
+        # Load outside the lock so other models stay available meanwhile
+        try:
+            return self._load(key)
+        except Exception:
+            with self._cond:
+                entry["total"] -= 1
+                entry["in_use"] -= 1
+                self.used_mb -= cost
+                self._cond.notify_all()
+            raise
+
+    def _discard(self, key, entry: dict, model):
+        """Forget a replica that can no longer serve (e.g. its whisper.cpp process died)."""
+        print(f"Dropping broken Whisper replica ({key[0]}, {key[1]})")
+        model.close()
+        entry["total"] -= 1
+        self.used_mb -= _footprint_mb(*key)
+        self._cond.notify_all()
+
+    def _make_room(self, key, cost: int) -> bool:
+        """Evict idle replicas of other models, oldest first, until `cost` fits."""
+        for other in list(self.entries):
+            if self.used_mb + cost <= self.budget_mb:
+                break
+            if other != key:
+                self._drop_idle(other)
+        return self.used_mb + cost <= self.budget_mb
+
+    def _drop_idle(self, key):
+        entry = self.entries[key]
+        cost = _footprint_mb(*key)
+        self.used_mb -= cost * len(entry["idle"])
+        entry["total"] -= len(entry["idle"])
+        entry["idle"].clear()
+        if entry["total"] == 0:
+            del self.entries[key]
+
+    def evict_idle(self):
+        """Unload models that have been idle for longer than idle_timeout."""
+        now = time.monotonic()
+        with self._cond:
+            for key in list(self.entries):
+                entry = self.entries[key]
+                if (
+                    key != self.pinned
+                    and entry["in_use"] == 0
+                    and now - entry["last_used"] > self.idle_timeout
+                ):
+                    print(f"Unloading idle Whisper model ({key[0]}, {key[1]})")
+                    self._drop_idle(key)
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._cond:
+            return {
+                "memory_mb": self.used_mb,
+                "budget_mb": self.budget_mb,
+                "loaded": {
+                    f"{name}/{compute_type}": {
+                        "replicas": entry["total"],
+                        "in_use": entry["in_use"],
+                        "idle_seconds": round(now - entry["last_used"], 1),
+                    }
+                    for (name, compute_type), entry in self.entries.items()
+                },
+            }
+
+
+class WorkerPool:
+    """
+    Fixed set of worker threads that run jobs on replicas borrowed from the
+    model registry.
+
+    Jobs wait in one of two bounded lanes. Free workers take interactive
+    jobs (live voice turns) first, so a long upload never holds them up;
+    bulk jobs run when the interactive lane is empty, and after
+    `interactive_burst` interactive jobs in a row one waiting bulk job runs
+    so bulk work cannot starve. CTranslate2 releases the GIL while it
+    decodes, so replicas run in parallel and the event loop stays free.
+    """
+
+    def __init__(self, registry: ModelRegistry, size: int, queue_size: int, bulk_queue_size: int,
+                 interactive_burst: int):
+        self.registry = registry
+        self.size = size
+        self.lanes = {INTERACTIVE: deque(), BULK: deque()}  # (queued at, future, model_key, fn, args)
+        self.limits = {INTERACTIVE: queue_size, BULK: bulk_queue_size}
+        self.interactive_burst = interactive_burst
+        self.busy = 0
+        self.avg_job_time = 1.0
+        self.bulk_promotions = 0  # bulk jobs run ahead of waiting interactive ones
+        self._streak = 0
+        self._cond = threading.Condition()
+
+    def start(self):
+        for i in range(self.size):
+            threading.Thread(target=self._worker, name=f"whisper-worker-{i}", daemon=True).start()
+
+    def queued(self) -> int:
+        return sum(len(jobs) for jobs in self.lanes.values())
+
+    def retry_after(self, lane: str = INTERACTIVE) -> int:
+        """Rough number of seconds until a slot in `lane` frees up."""
+        backlog = len(self.lanes[lane]) + 1
+        if lane == BULK:
+            backlog += len(self.lanes[INTERACTIVE])
+        return max(1, math.ceil(backlog * self.avg_job_time / self.size))
+
+    def submit(self, model_key: tuple, fn, *args, lane: str = INTERACTIVE) -> concurrent.futures.Future:
+        """Queue fn(model, *args) for a replica of model_key, or raise PoolBusy."""
+        future = concurrent.futures.Future()
+        with self._cond:
+            jobs = self.lanes[lane]
+            if len(jobs) >= self.limits[lane]:
+                raise PoolBusy(self.retry_after(lane))
+            jobs.append((time.monotonic(), future, model_key, fn, args))
+            self._cond.notify()
+        return future
+
+    async def run(self, model_key: tuple, fn, *args, lane: str = INTERACTIVE):
+        """Run fn(model, *args) on a replica of model_key."""
+        return await asyncio.wrap_future(self.submit(model_key, fn, *args, lane=lane))
+
+    def _next_job(self):
+        interactive, bulk = self.lanes[INTERACTIVE], self.lanes[BULK]
+        if bulk and (not interactive or self._streak >= self.interactive_burst):
+            if interactive:
+                self.bulk_promotions += 1
+            self._streak = 0
+            return bulk.popleft()
+        self._streak = self._streak + 1 if bulk else 0
+        return interactive.popleft()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not any(self.lanes.values()):
+                    self._cond.wait()
+                _, future, model_key, fn, args = self._next_job()
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self.busy += 1
+            start = time.monotonic()
+            try:
+                with self.registry.acquire(model_key) as model:
+                    future.set_result(fn(model, *args))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                elapsed = time.monotonic() - start
+                with self._cond:
+                    self.busy -= 1
+                    self.avg_job_time = 0.8 * self.avg_job_time + 0.2 * elapsed
+
+    def lane_stats(self) -> dict:
+        now = time.monotonic()
+        with self._cond:
+            stats = {
+                lane: {
+                    "queued": len(jobs),
+                    "max": self.limits[lane],
+                    "oldest_wait": round(now - jobs[0][0], 2) if jobs else 0.0,
+                }
+                for lane, jobs in self.lanes.items()
+            }
+            stats["bulk_promotions"] = self.bulk_promotions
+            return stats
+
+
+def _wav_pcm16(content: bytes):
+    """
+    Locate the sample data of a 16-bit PCM WAV without copying it.
+    Returns (memoryview, sample_rate, channels), or None for anything else.
+    """
+    if len(content) < 12 or content[:4] != b"RIFF" or content[8:12] != b"WAVE":
+        return None
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(content):
+        chunk_id = content[pos:pos + 4]
+        size = int.from_bytes(content[pos + 4:pos + 8], "little")
+        body = pos + 8
+        if chunk_id == b"fmt " and size >= 16:
+            tag, channels, rate = struct.unpack_from("<HHI", content, body)
+            bits = struct.unpack_from("<H", content, body + 14)[0]
+            fmt = (tag, channels, rate, bits)
+        elif chunk_id == b"data":
+            if fmt is None:
+                return None
+            tag, channels, rate, bits = fmt
+            # 1 = PCM, 0xFFFE = WAVE_FORMAT_EXTENSIBLE
+            if tag not in (1, 0xFFFE) or bits != 16 or channels < 1:
+                return None
+            # Streaming writers leave the size at 0 or 0xFFFFFFFF
+            end = len(content) if size in (0, 0xFFFFFFFF) else min(body + size, len(content))
+            end -= (end - body) % (2 * channels)
+            return memoryview(content)[body:end], rate, channels
+        pos = body + size + (size & 1)
+    return None
+
+
+def resample(audio: np.ndarray, rate: int) -> np.ndarray:
+    """Resample float32 mono audio to SAMPLE_RATE (no-op at 16 kHz)."""
+    if rate == SAMPLE_RATE or not len(audio):
+        return audio
+    if soxr is not None:
+        return soxr.resample(audio, rate, SAMPLE_RATE).astype(np.float32, copy=False)
+    length = int(round(len(audio) * SAMPLE_RATE / rate))
+    positions = np.arange(length, dtype=np.float64) * (rate / SAMPLE_RATE)
+    return np.interp(positions, np.arange(len(audio)), audio).astype(np.float32)
+
+
+def decode_pcm16(pcm, rate: int, channels: int = 1) -> np.ndarray:
+    """Interleaved s16le samples (bytes or memoryview) to 16 kHz mono float32."""
+    usable = len(pcm) - len(pcm) % (2 * channels)
+    samples = np.frombuffer(pcm[:usable], dtype="<i2")
+    if channels > 1:
+        audio = samples.reshape(-1, channels).mean(axis=1, dtype=np.float32) / 32768.0
+    else:
+        audio = np.multiply(samples, 1 / 32768.0, dtype=np.float32)
+    return resample(audio, rate)
+
+
+def decode_audio_bytes(content: bytes) -> np.ndarray:
+    """
+    Decode an upload to 16 kHz mono float32 entirely in memory.
+    16-bit PCM WAV is read straight from the upload buffer (zero-copy view,
+    resampled only when not 16 kHz); anything else goes through PyAV from a
+    BytesIO instead of a temp file.
+    """
+    wav = _wav_pcm16(content)
+    if wav is not None:
+        return decode_pcm16(*wav)
+    return decode_audio(io.BytesIO(content), sampling_rate=SAMPLE_RATE)
+
+
+def split_on_silence(audio: np.ndarray, target_seconds: float) -> list:
+    """
+    Cut long audio into contiguous (start, end) sample ranges of roughly
+    target_seconds, placing every cut in the middle of a VAD-detected silence.
+    """
+    target = int(target_seconds * SAMPLE_RATE)
+    speech = get_speech_timestamps(
+        audio,
+        VadOptions(min_silence_duration_ms=300, max_speech_duration_s=target_seconds)
+    )
+    cuts = [0]
+    for previous, following in zip(speech, speech[1:]):
+        if following["end"] - cuts[-1] > target:
+            cut = (previous["end"] + following["start"]) // 2
+            if cut > cuts[-1]:
+                cuts.append(cut)
+    cuts.append(len(audio))
+    return list(zip(cuts, cuts[1:]))
+
+
+def _normalize_word(word: str) -> str:
+    return re.sub(r"[^\w']", "", word.lower())
+
+
+class StreamingTranscriber:
+    """
+    Sliding-window state for one /transcribe/stream connection.
+
+    The window is re-decoded every STREAM_STEP seconds of new audio. A word is
+    confirmed once two consecutive decodes agree on it, and the window is then
+    trimmed up to the last confirmed word so it never outgrows Whisper's context.
+    """
+
+    def __init__(self):
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.offset = 0.0  # stream time of buffer[0], in seconds
+        self.committed = []  # confirmed (start, end, word)
+        self.tentative = []  # latest unconfirmed (start, end, word)
+        self.pending = 0  # samples received since the last decode
+
+    @property
+    def committed_text(self) -> str:
+        return "".join(w for _, _, w in self.committed).strip()
+
+    @property
+    def tentative_text(self) -> str:
+        return "".join(w for _, _, w in self.tentative).strip()
+
+    @property
+    def prompt(self) -> Optional[str]:
+        return self.committed_text[-200:] or None
+
+    def append(self, pcm: bytes):
+        pcm = pcm[:len(pcm) - len(pcm) % 2]
+        samples = np.frombuffer(pcm, dtype="<i2")
+        self.buffer = np.concatenate(
+            (self.buffer, np.multiply(samples, 1 / 32768.0, dtype=np.float32))
+        )
+        self.pending += len(samples)
+
+    def ready(self) -> bool:
+        return self.pending >= STREAM_STEP * SAMPLE_RATE
+
+    def update(self, words: list, final: bool = False):
+        """Merge the words of a fresh decode of the current window."""
+        self.pending = 0
+        committed_end = self.committed[-1][1] if self.committed else 0.0
+        hypothesis = [
+            (start + self.offset, end + self.offset, word)
+            for start, end, word in words
+            if start + self.offset >= committed_end - 0.05
+        ]
+
+        if final:
+            self.committed.extend(hypothesis)
+            self.tentative = []
+            return
+
+        agreed = 0
+        for new, old in zip(hypothesis, self.tentative):
+            if _normalize_word(new[2]) != _normalize_word(old[2]):
+                break
+            agreed += 1
+        self.committed.extend(hypothesis[:agreed])
+        self.tentative = hypothesis[agreed:]
+        self._trim()
+
+    def _trim(self):
+        duration = len(self.buffer) / SAMPLE_RATE
+        if duration <= STREAM_WINDOW:
+            return
+        cut = (self.committed[-1][1] - self.offset) if self.committed else 0.0
+        if cut <= 0 and duration > STREAM_MAX_WINDOW:
+            # Nothing stabilised in a full window: accept the hypothesis as is
+            self.committed.extend(self.tentative)
+            self.tentative = []
+            cut = duration
+        if cut > 0:
+            samples = min(int(cut * SAMPLE_RATE), len(self.buffer))
+            self.buffer = self.buffer[samples:]
+            self.offset += samples / SAMPLE_RATE
+
+
+class MicroBatcher:
+    """
+    Groups short clips that arrive within BATCH_MAX_WAIT_MS of each other
+    and share the same decode options into a single batched encoder/decoder
+    pass on one worker.
+
+    Only options that decode a clip the same way alone or batched qualify:
+    a pinned language (a batch detects one language for all its clips) and
+    a single temperature (the batched pipeline has no fallback), without a
+    session's initial prompt (each session has its own, so such clips could
+    only batch with themselves). Anything else, such as the default accurate
+    profile, runs clip by clip.
+    """
+
+    def __init__(self, pool: WorkerPool, max_size: int, max_wait_ms: float):
+        self.pool = pool
+        self.max_size = max_size
+        self.max_wait = max_wait_ms / 1000
+        self.pending = {}  # options key -> [(audio, future)]
+        self._timers = {}
+        self._tasks = set()
+        self.batches = 0
+        self.batched_clips = 0
+
+    async def transcribe(self, model_key: tuple, audio: np.ndarray, options: dict, lane: str = INTERACTIVE):
+        """Return (text, language, duration) for one clip."""
+        duration = len(audio) / SAMPLE_RATE
+        if (
+            self.max_size <= 1
+            or options.get("vad_filter")
+            or not options.get("language")
+            or not isinstance(options.get("temperature"), (int, float))
+            or options.get("initial_prompt")
+            or not 0 < duration < BATCH_MAX_SECONDS
+        ):
+            return await self.pool.run(model_key, _transcribe, audio, options, lane=lane)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = json.dumps([model_key, options, lane], sort_keys=True)
+        group = self.pending.setdefault(key, [])
+        group.append((audio, future))
+        if len(group) >= self.max_size:
+            self._flush(key, model_key, options, lane)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(
+                self.max_wait, self._flush, key, model_key, options, lane
+            )
+        return await future
+
+    def _flush(self, key: str, model_key: tuple, options: dict, lane: str):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self.pending.pop(key, [])
+        if batch:
+            task = asyncio.create_task(self._run(batch, model_key, options, lane))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list, model_key: tuple, options: dict, lane: str):
+        clips = [audio for audio, _ in batch]
+        try:
+            if len(clips) == 1:
+                results = [await self.pool.run(model_key, _transcribe, clips[0], options, lane=lane)]
+            else:
+                results = await self.pool.run(model_key, _transcribe_batch, clips, options, lane=lane)
+                self.batches += 1
+                self.batched_clips += len(clips)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+class TranscriptionCache:
+    """
+    LRU of finished transcriptions keyed by audio content and decode options,
+    bounded by the approximate memory its entries hold.
+    """
+
+    ENTRY_OVERHEAD = 256  # dict slot, tuple and key object, roughly
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (result, cost)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(content: bytes, **options) -> str:
+        digest = hashlib.sha256(content)
+        digest.update(json.dumps(options, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key: str, result: tuple):
+        cost = self.ENTRY_OVERHEAD + len(key) + len(result[0].encode())
+        if cost > self.max_bytes:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.bytes -= old[1]
+        self.entries[key] = (result, cost)
+        self.bytes += cost
+        while self.bytes > self.max_bytes:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.bytes -= evicted
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes
+        }
+
+
+class SessionStore:
+    """
+    Decoding context of recent conversations, keyed by client session id:
+    the language detected so far and the tail of the transcript. Reusing them
+    on the next clip skips language detection and primes the decoder with
+    the running context. LRU-bounded; sessions expire after `ttl` idle seconds.
+    """
+
+    def __init__(self, max_sessions: int, ttl: float, prompt_chars: int):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.prompt_chars = prompt_chars
+        self.sessions = OrderedDict()  # session id -> (language, prompt, last used)
+
+    def _expire(self, now: float):
+        while self.sessions:
+            _, (_, _, last_used) = next(iter(self.sessions.items()))
+            if now - last_used < self.ttl:
+                break
+            self.sessions.popitem(last=False)
 
-# Load Whisper model
-print(f"Loading Whisper model ({MODEL_SIZE}) on {DEVICE}...")
-model = WhisperModel(MODEL_SIZE, device=DEVICE, compute_type=COMPUTE_TYPE)
-print("Whisper model loaded successfully!")
+    def apply(self, session_id: Optional[str], options: dict, language_given: bool) -> dict:
+        """Options for the session's next clip; an explicit language wins."""
+        if not session_id:
+            return options
+        self._expire(time.monotonic())
+        entry = self.sessions.get(session_id)
+        if entry is None:
+            return options
+        language, prompt, _ = entry
+        options = dict(options)
+        if language and not language_given:
+            options["language"] = language
+        if prompt:
+            options["initial_prompt"] = prompt
+        return options
+
+    def update(self, session_id: Optional[str], language: Optional[str], text: str):
+        if not session_id:
+            return
+        now = time.monotonic()
+        old_language, old_prompt, _ = self.sessions.pop(session_id, (None, "", 0))
+        prompt = f"{old_prompt} {text}".strip()[-self.prompt_chars:] if self.prompt_chars else ""
+        # Cut back to a word boundary so the prompt never starts mid-word
+        if len(prompt) == self.prompt_chars and " " in prompt:
+            prompt = prompt.split(" ", 1)[1]
+        self.sessions[session_id] = (language or old_language, prompt, now)
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+        self._expire(now)
+
+    def stats(self) -> dict:
+        self._expire(time.monotonic())
+        return {"active": len(self.sessions), "max": self.max_sessions, "ttl": self.ttl}
+
+
+def resolve_options(
+    profile: Optional[str] = None,
+    language: Optional[str] = None,
+    beam_size: Optional[int] = None,
+    vad_filter: Optional[bool] = None,
+    without_timestamps: Optional[bool] = None,
+) -> dict:
+    """Expand a profile name plus per-request overrides into decode options."""
+    name = profile or DEFAULT_PROFILE
+    if name not in PROFILES:
+        raise ValueError(f"Unknown profile '{name}', expected one of {sorted(PROFILES)}")
+    if beam_size is not None and beam_size < 1:
+        raise ValueError("beam_size must be at least 1")
+
+    options = dict(PROFILES[name])
+    overrides = {
+        "language": language,
+        "beam_size": beam_size,
+        "vad_filter": vad_filter,
+        "without_timestamps": without_timestamps,
+    }
+    options.update({k: v for k, v in overrides.items() if v is not None})
+    return options
+
+
+def resolve_model(model: Optional[str] = None, compute_type: Optional[str] = None) -> tuple:
+    """Validate a requested model against the served set; returns a registry key."""
+    name = model or MODEL_SIZE
+    compute_type = compute_type or COMPUTE_TYPE
+    if name not in SERVED_MODELS:
+        raise ValueError(f"Unknown model '{name}', expected one of {sorted(SERVED_MODELS)}")
+    if compute_type not in COMPUTE_TYPES:
+        raise ValueError(f"Unknown compute_type '{compute_type}'")
+    return name, compute_type
+
+
+# Default model replicas are loaded in the background once the server binds
+DEFAULT_MODEL = (MODEL_SIZE, COMPUTE_TYPE)
+registry = ModelRegistry(MODEL_MEMORY_MB, MODEL_IDLE_TIMEOUT, WORKERS, pinned=DEFAULT_MODEL)
+pool = WorkerPool(registry, WORKERS, QUEUE_SIZE, BULK_QUEUE_SIZE, INTERACTIVE_BURST)
+batcher = MicroBatcher(pool, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS)
+cache = TranscriptionCache(CACHE_MAX_BYTES)
+sessions = SessionStore(SESSION_MAX, SESSION_TTL, SESSION_PROMPT_CHARS)
+readiness = {"ready": False, "error": None}
+
+
+def _warmup(model):
+    """Synthetic transcription so the first real request skips kernel warm-up."""
+    noise = np.random.default_rng(0).normal(0, 0.01, 2 * SAMPLE_RATE).astype(np.float32)
+    _transcribe(model, noise, PROFILES[DEFAULT_PROFILE])
+
+
+def _load_default_model():
+    start = time.monotonic()
+    print(f"Loading {WORKERS} Whisper model replica(s) ({MODEL_SIZE}) on {DEVICE}...")
+    try:
+        registry.preload(DEFAULT_MODEL, WORKERS, warmup=_warmup)
+    except Exception as e:
+        readiness["error"] = str(e)
+        print(f"Failed to load Whisper model: {e}")
+        return
+    readiness["ready"] = True
+    print(f"Whisper model loaded and warmed up in {time.monotonic() - start:.1f}s")
 
 class TranscriptionResponse(BaseModel):
     success: bool
     text: str
     language: Optional[str] = None
     duration: Optional[float] = None
+    options: Optional[dict] = None
+
+class BatchItem(TranscriptionResponse):
+    filename: Optional[str] = None
+    error: Optional[str] = None
+
+class BatchTranscriptionResponse(BaseModel):
+    success: bool
+    results: List[BatchItem]
+    options: dict
 
 class HealthResponse(BaseModel):
     status: str
+    ready: bool
+    backend: str
     model: str
     device: str
+    workers: int
+    busy_workers: int
+    queued: int
+    lanes: dict
+    batches: int
+    batched_clips: int
+    cache: dict
+    sessions: dict
+    models: dict
+
+async def _evict_idle_models():
+    while True:
+        await asyncio.sleep(min(60.0, MODEL_IDLE_TIMEOUT))
+        registry.evict_idle()
+
+@app.on_event("startup")
+async def startup_event():
+    pool.start()
+    app.state.loader = asyncio.create_task(asyncio.to_thread(_load_default_model))
+    app.state.evictor = asyncio.create_task(_evict_idle_models())
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: 200 once the default model is loaded and warmed up."""
+    if readiness["ready"]:
+        return {"status": "ready", "model": MODEL_SIZE}
+    status = "failed" if readiness["error"] else "loading"
+    return JSONResponse(
+        status_code=503,
+        content={"status": status, "model": MODEL_SIZE, "error": readiness["error"]}
+    )
 
 @app.get("/health")
 async def health_check() -> HealthResponse:
-    """Health check endpoint."""
+    """Liveness check; see /ready for model readiness."""
     return HealthResponse(
         status="healthy",
+        ready=readiness["ready"],
+        backend=BACKEND,
         model=MODEL_SIZE,
-        device=DEVICE
+        device=DEVICE,
+        workers=pool.size,
+        busy_workers=pool.busy,
+        queued=pool.queued(),
+        lanes=pool.lane_stats(),
+        batches=batcher.batches,
+        batched_clips=batcher.batched_clips,
+        cache=cache.stats(),
+        sessions=sessions.stats(),
+        models=registry.stats()
     )
 
-@app.post("/transcribe", response_model=TranscriptionResponse)
-async def transcribe_audio(file: UploadFile = File(...)):
+def _transcribe(model, audio, options, on_segment=None, cancelled=None):
     """
-    Transcribe audio file to text.
+    Run a full transcription on a worker thread (segments are lazy).
+    on_segment(segment) is called as each segment is decoded; setting the
+    `cancelled` event stops decoding after the current segment.
+    """
+    segments, info = model.transcribe(audio, **options)
+    
+    # Combine all segments
+    full_text = ""
+    for segment in segments:
+        full_text += segment.text + " "
+        if on_segment is not None:
+            on_segment(segment)
+        if cancelled is not None and cancelled.is_set():
+            break
+    return full_text.strip(), info.language, info.duration
+
+def _transcribe_batch(model, clips, options):
+    """
+    Transcribe several short clips in one batched pass.
+    The clips are laid end to end and each becomes one clip_timestamps chunk,
+    so the batched pipeline encodes and decodes them together. The options
+    pin the language and a single temperature (see MicroBatcher).
     """
+    bounds = np.cumsum([0] + [len(clip) for clip in clips]) / SAMPLE_RATE
+    starts = list(bounds[:-1])
+    segments, info = BatchedInferencePipeline(model).transcribe(
+        np.concatenate(clips),
+        clip_timestamps=[{"start": start, "end": end} for start, end in zip(bounds[:-1], bounds[1:])],
+        batch_size=len(clips),
+        beam_size=options["beam_size"],
+        language=options["language"],
+        temperature=options["temperature"],
+        without_timestamps=options.get("without_timestamps", True)
+    )
+
+    texts = [""] * len(clips)
+    for segment in segments:
+        index = max(0, bisect.bisect_right(starts, segment.start + 1e-3) - 1)
+        texts[index] += segment.text + " "
+    return [
+        (text.strip(), info.language, len(clip) / SAMPLE_RATE)
+        for text, clip in zip(texts, clips)
+    ]
+
+def _transcribe_words(model, audio, prompt):
+    """Greedy word-timestamped decode of a streaming window."""
+    segments, _ = model.transcribe(
+        audio,
+        beam_size=1,
+        word_timestamps=True,
+        condition_on_previous_text=False,
+        initial_prompt=prompt
+    )
+    return [(w.start, w.end, w.word) for segment in segments for w in segment.words or []]
+
+async def _decode_upload(decode, content: bytes) -> np.ndarray:
     try:
-        # Save uploaded file to temporary location
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
-            content = await file.read()
-            tmp.write(content)
-            tmp_path = tmp.name
-        
-        # Transcribe
-        segments, info = model.transcribe(tmp_path, beam_size=5)
-        
-        # Combine all segments
-        full_text = ""
-        for segment in segments:
-            full_text += segment.text + " "
-        full_text = full_text.strip()
-        
-        # Clean up
-        os.unlink(tmp_path)
-        
-        return TranscriptionResponse(
-            success=True,
-            text=full_text,
-            language=info.language,
-            duration=info.duration
+        return await asyncio.to_thread(decode, content)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not decode audio: {e}")
+
+def _busy_error(e: PoolBusy) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail=str(e),
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+def _segment_line(segment, offset: float = 0.0) -> dict:
+    return {
+        "type": "segment",
+        "text": segment.text.strip(),
+        "start": round(segment.start + offset, 3),
+        "end": round(segment.end + offset, 3),
+        "avg_logprob": segment.avg_logprob
+    }
+
+def _transcribe_segments(model, audio, options, offset):
+    """Transcribe one chunk of a split recording into timestamp-corrected segment lines."""
+    segments, info = model.transcribe(audio, **options)
+    return [_segment_line(segment, offset) for segment in segments], info.language
+
+def _request_lane(request: Request, default: Optional[str] = None) -> Optional[str]:
+    """Scheduling lane from the X-Priority header; None leaves it to _lane_for()."""
+    lane = request.headers.get("x-priority", default)
+    if lane is not None and lane not in (INTERACTIVE, BULK):
+        raise HTTPException(status_code=400, detail=f"X-Priority must be '{INTERACTIVE}' or '{BULK}'")
+    return lane
+
+def _lane_for(audio: np.ndarray, lane: Optional[str] = None) -> str:
+    if lane is not None:
+        return lane
+    return BULK if len(audio) > INTERACTIVE_MAX_SECONDS * SAMPLE_RATE else INTERACTIVE
+
+def _should_split(audio: np.ndarray) -> bool:
+    return SPLIT_MIN_SECONDS > 0 and pool.size > 1 and len(audio) > SPLIT_MIN_SECONDS * SAMPLE_RATE
+
+async def _retry_when_busy(run):
+    """Await run(), waiting Retry-After and trying again while the queue is full."""
+    for attempt in range(BATCH_BUSY_RETRIES + 1):
+        try:
+            return await run()
+        except PoolBusy as e:
+            if attempt == BATCH_BUSY_RETRIES:
+                raise
+            await asyncio.sleep(e.retry_after)
+
+async def _split_transcription(audio: np.ndarray, model_key: tuple, options: dict, lane: str):
+    """
+    Transcribe a long recording as silence-delimited chunks spread across the
+    workers. Returns an async iterator of segment lines in order with
+    timestamps shifted to the whole recording, then a {"type": "done"} line
+    with the stitched result. The first chunk is queued before this returns,
+    so a full queue raises PoolBusy here (a 503) rather than mid-stream;
+    later chunks wait Retry-After and try again.
+    """
+    ranges = await asyncio.to_thread(split_on_silence, audio, SPLIT_CHUNK_SECONDS)
+    slots = asyncio.Semaphore(pool.size)  # enough to occupy every worker, no more
+
+    def submit(start, end):
+        return pool.submit(
+            model_key, _transcribe_segments, audio[start:end], options, start / SAMPLE_RATE, lane=lane
         )
-        
+
+    async def first_chunk(job):
+        try:
+            return await asyncio.wrap_future(job)
+        finally:
+            slots.release()
+
+    async def run_chunk(start, end):
+        async with slots:
+            return await _retry_when_busy(lambda: asyncio.wrap_future(submit(start, end)))
+
+    await slots.acquire()
+    try:
+        first = submit(*ranges[0])
+    except PoolBusy:
+        slots.release()
+        raise
+    tasks = [asyncio.ensure_future(first_chunk(first))]
+    tasks += [asyncio.ensure_future(run_chunk(start, end)) for start, end in ranges[1:]]
+
+    async def lines():
+        texts = []
+        languages = Counter()
+        try:
+            for (start, end), task in zip(ranges, tasks):
+                chunk_lines, language = await task
+                languages[language] += end - start
+                for line in chunk_lines:
+                    texts.append(line["text"])
+                    yield line
+        finally:
+            for task in tasks:
+                task.cancel()
+        yield {
+            "type": "done",
+            "text": " ".join(text for text in texts if text),
+            "language": languages.most_common(1)[0][0] if languages else None,
+            "duration": len(audio) / SAMPLE_RATE
+        }
+
+    return lines()
+
+async def _run_transcription(audio: np.ndarray, model_key: tuple, options: dict, lane: Optional[str] = None,
+                             retry_busy: bool = False):
+    """
+    Transcribe decoded audio, mapping failures to HTTP errors. With
+    `retry_busy` a full queue is waited out (see _retry_when_busy) before
+    it becomes a 503.
+    """
+    lane = _lane_for(audio, lane)
+
+    async def run():
+        if _should_split(audio):
+            async for line in await _split_transcription(audio, model_key, options, lane):
+                if line["type"] == "done":
+                    return line["text"], line["language"], line["duration"]
+        return await batcher.transcribe(model_key, audio, options, lane)
+
+    try:
+        return await (_retry_when_busy(run) if retry_busy else run())
+    except PoolBusy as e:
+        raise _busy_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _stream_transcription(audio: np.ndarray, model_key: tuple, options: dict, on_done, echo: dict,
+                                lane: Optional[str] = None):
+    """
+    NDJSON response: one {"type": "segment"} line per segment as soon as it is
+    decoded, then a {"type": "done"} summary (or {"type": "error"}). Decoding
+    stops after the current segment if the client disconnects. Long uploads
+    are split and their chunks decoded in parallel, streamed in order. Either
+    way the (first) job is queued before the response starts, so a full
+    queue is a 503, not an error line. `on_done` receives the (text, language, duration) of a completed decode.
+    """
+    lane = _lane_for(audio, lane)
+    if _should_split(audio):
+        try:
+            split_lines = await _split_transcription(audio, model_key, options, lane)
+        except PoolBusy as e:
+            raise _busy_error(e)
+
+        async def split_body():
+            try:
+                async for line in split_lines:
+                    if line["type"] == "done":
+                        on_done((line["text"], line["language"], line["duration"]))
+                        line["options"] = echo
+                    yield json.dumps(line) + "\n"
+            except Exception as e:
+                yield json.dumps({"type": "error", "detail": str(e)}) + "\n"
+
+        return StreamingResponse(split_body(), media_type="application/x-ndjson")
+
+    loop = asyncio.get_running_loop()
+    lines = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def on_segment(segment):
+        loop.call_soon_threadsafe(lines.put_nowait, _segment_line(segment))
+
+    try:
+        job = pool.submit(model_key, _transcribe, audio, options, on_segment, cancelled, lane=lane)
+    except PoolBusy as e:
+        raise _busy_error(e)
+    job.add_done_callback(lambda _: loop.call_soon_threadsafe(lines.put_nowait, None))
+
+    async def body():
+        try:
+            while (line := await lines.get()) is not None:
+                yield json.dumps(line) + "\n"
+            try:
+                full_text, language, duration = job.result()
+            except Exception as e:
+                yield json.dumps({"type": "error", "detail": str(e)}) + "\n"
+                return
+            if not cancelled.is_set():
+                on_done((full_text, language, duration))
+            yield json.dumps({
+                "type": "done",
+                "text": full_text,
+                "language": language,
+                "duration": duration,
+                "options": echo
+            }) + "\n"
+        finally:
+            cancelled.set()
+            job.cancel()
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+def _cache_key(content: bytes, model_key: tuple, options: dict, **extra) -> str:
+    return TranscriptionCache.key(
+        content, model=model_key[0], compute_type=model_key[1], **options, **extra
+    )
+
+async def _transcribe_content(content: bytes, decode, model_key: tuple, options: dict,
+                              lane: Optional[str] = None, session_id: Optional[str] = None,
+                              language_given: bool = False, retry_busy: bool = False, **key_extra):
+    """
+    Cached decode + transcribe of one upload; returns (text, language, duration).
+    The cache is keyed on the requested options, before the session's context
+    is applied, so a retried or repeated clip still hits; a hit does not
+    extend the session again.
+    """
+    cache_key = _cache_key(content, model_key, options, **key_extra)
+    result = cache.get(cache_key)
+    if result is None:
+        audio = await _decode_upload(decode, content)
+        decode_options = sessions.apply(session_id, options, language_given)
+        result = await _run_transcription(audio, model_key, decode_options, lane, retry_busy)
+        cache.put(cache_key, result)
+        sessions.update(session_id, result[1], result[0])
+    return result
+
+async def _respond(request: Request, content: bytes, decode, model_key: tuple, options: dict, echo: dict,
+                   session_id: Optional[str] = None, language_given: bool = False, **key_extra):
+    """Shared JSON-or-NDJSON flow of the single-upload endpoints."""
+    lane = _request_lane(request)
+    if "application/x-ndjson" in request.headers.get("accept", ""):
+        # Keyed before the session is applied, as in _transcribe_content
+        cache_key = _cache_key(content, model_key, options, **key_extra)
+        result = cache.get(cache_key)
+        if result is None:
+            audio = await _decode_upload(decode, content)
+            decode_options = sessions.apply(session_id, options, language_given)
+
+            def on_done(result):
+                cache.put(cache_key, result)
+                sessions.update(session_id, result[1], result[0])
+
+            return await _stream_transcription(audio, model_key, decode_options, on_done, echo, lane)
+        # Cached: segments were not kept, so answer with the summary line only
+        full_text, language, duration = result
+        summary = {"type": "done", "text": full_text, "language": language,
+                   "duration": duration, "options": echo}
+        return StreamingResponse(iter([json.dumps(summary) + "\n"]), media_type="application/x-ndjson")
+
+    full_text, language, duration = await _transcribe_content(
+        content, decode, model_key, options, lane, session_id, language_given, **key_extra
+    )
+    return TranscriptionResponse(
+        success=True,
+        text=full_text,
+        language=language,
+        duration=duration,
+        options=echo
+    )
+
+def _resolve_request(profile, language, beam_size, vad_filter, without_timestamps, model, compute_type):
+    """
+    Resolve decode options and model, returning (model_key, options, echo).
+    Session context is applied later, on a cache miss (see _transcribe_content).
+    """
+    try:
+        options = resolve_options(profile, language, beam_size, vad_filter, without_timestamps)
+        model_key = resolve_model(model, compute_type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    echo = {
+        "profile": profile or DEFAULT_PROFILE,
+        "model": model_key[0],
+        "compute_type": model_key[1],
+        **options
+    }
+    return model_key, options, echo
+
+@app.post("/transcribe", response_model=TranscriptionResponse)
+async def transcribe_audio(
+    request: Request,
+    file: UploadFile = File(...),
+    profile: Optional[str] = Form(None),
+    language: Optional[str] = Form(None),
+    beam_size: Optional[int] = Form(None),
+    vad_filter: Optional[bool] = Form(None),
+    without_timestamps: Optional[bool] = Form(None),
+    model: Optional[str] = Form(None),
+    compute_type: Optional[str] = Form(None),
+    session_id: Optional[str] = Form(None),
+):
+    """
+    Transcribe audio file to text.
+    `profile` picks a named set of decode options ("realtime" or "accurate");
+    the remaining fields override individual options. `model` and
+    `compute_type` select a model from the registry (default: the server's).
+    Clips sharing a `session_id` reuse the language detected earlier in the
+    session and are prompted with its recent transcript.
+    With `Accept: application/x-ndjson` segments are streamed as decoded.
+    `X-Priority: interactive | bulk` picks the scheduling lane; by default
+    clips up to WHISPER_INTERACTIVE_MAX_SECONDS are interactive.
+    """
+    model_key, options, echo = _resolve_request(
+        profile, language, beam_size, vad_filter, without_timestamps, model, compute_type
+    )
+    content = await file.read()
+    return await _respond(request, content, decode_audio_bytes, model_key, options, echo, session_id,
+                          language_given=language is not None)
+
+@app.post("/transcribe/pcm", response_model=TranscriptionResponse)
+async def transcribe_pcm(
+    request: Request,
+    sample_rate: Optional[int] = Query(None),
+    profile: Optional[str] = Query(None),
+    language: Optional[str] = Query(None),
+    beam_size: Optional[int] = Query(None),
+    vad_filter: Optional[bool] = Query(None),
+    without_timestamps: Optional[bool] = Query(None),
+    model: Optional[str] = Query(None),
+    compute_type: Optional[str] = Query(None),
+    session_id: Optional[str] = Query(None),
+):
+    """
+    Transcribe a raw application/octet-stream body of s16le mono samples.
+    The rate comes from ?sample_rate= or the X-Sample-Rate header (default
+    16000); other rates are resampled. Options are query parameters with the
+    same meaning as the /transcribe form fields.
+    """
+    try:
+        rate = sample_rate or int(request.headers.get("x-sample-rate", SAMPLE_RATE))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="X-Sample-Rate must be an integer")
+    if not 8000 <= rate <= 192000:
+        raise HTTPException(status_code=400, detail=f"Unsupported sample rate {rate}")
+    model_key, options, echo = _resolve_request(
+        profile, language, beam_size, vad_filter, without_timestamps, model, compute_type
+    )
+    content = await request.body()
+    if not content:
+        raise HTTPException(status_code=400, detail="Empty audio body")
+    decode = functools.partial(decode_pcm16, rate=rate)
+    return await _respond(request, content, decode, model_key, options, echo, session_id,
+                          language_given=language is not None, sample_rate=rate)
+
+@app.post("/transcribe/batch", response_model=BatchTranscriptionResponse)
+async def transcribe_batch(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    profile: Optional[str] = Form(None),
+    language: Optional[str] = Form(None),
+    beam_size: Optional[int] = Form(None),
+    vad_filter: Optional[bool] = Form(None),
+    without_timestamps: Optional[bool] = Form(None),
+    model: Optional[str] = Form(None),
+    compute_type: Optional[str] = Form(None),
+):
+    """
+    Transcribe many files from one multipart request in parallel.
+    Results come back in input order; a file that fails gets its own error
+    instead of failing the whole request. Options apply to every file.
+    Files run in the bulk lane unless X-Priority says otherwise.
+    """
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=413, detail=f"At most {BATCH_MAX_FILES} files per batch request"
+        )
+    lane = _request_lane(request, default=BULK)
+    model_key, options, echo = _resolve_request(
+        profile, language, beam_size, vad_filter, without_timestamps, model, compute_type
+    )
+    # Enough in flight to keep every worker busy and fill micro-batches,
+    # without overflowing the queue of its lane
+    slots = asyncio.Semaphore(FANOUT_CONCURRENCY)
+
+    async def transcribe_one(upload: UploadFile) -> BatchItem:
+        async with slots:
+            content = await upload.read()
+            await upload.close()
+            try:
+                # Decoded and looked up in the cache once; only a full queue is retried
+                full_text, language, duration = await _transcribe_content(
+                    content, decode_audio_bytes, model_key, options, lane, retry_busy=True
+                )
+            except HTTPException as e:
+                return BatchItem(filename=upload.filename, success=False, text="", error=e.detail)
+            return BatchItem(
+                filename=upload.filename,
+                success=True,
+                text=full_text,
+                language=language,
+                duration=duration
+            )
+
+    results = await asyncio.gather(*(transcribe_one(upload) for upload in files))
+    return BatchTranscriptionResponse(
+        success=all(item.success for item in results),
+        results=results,
+        options=echo
+    )
+
+@app.websocket("/transcribe/stream")
+async def transcribe_stream(websocket: WebSocket):
+    """
+    Incremental transcription of live audio.
+
+    The client sends binary frames of 16 kHz mono s16le PCM as they are
+    captured, then {"type": "end"} as text. The server answers with
+    {"type": "partial", "text", "tentative"} as the window is re-decoded and
+    {"type": "final", "text"} once the stream ends.
+    """
+    await websocket.accept()
+    stream = StreamingTranscriber()
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("bytes"):
+                stream.append(message["bytes"])
+                if not stream.ready():
+                    continue
+                try:
+                    words = await pool.run(
+                        DEFAULT_MODEL, _transcribe_words, stream.buffer, stream.prompt
+                    )
+                except PoolBusy:
+                    continue  # retry with more audio on the next frame
+                stream.update(words)
+                await websocket.send_json({
+                    "type": "partial",
+                    "text": stream.committed_text,
+                    "tentative": stream.tentative_text
+                })
+            elif message.get("text"):
+                try:
+                    control = json.loads(message["text"])
+                except ValueError:
+                    continue
+                if isinstance(control, dict) and control.get("type") == "end":
+                    break
+
+        if len(stream.buffer):
+            words = await pool.run(DEFAULT_MODEL, _transcribe_words, stream.buffer, stream.prompt)
+            stream.update(words, final=True)
+        await websocket.send_json({"type": "final", "text": stream.committed_text})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    except PoolBusy as e:
+        await websocket.close(code=1013, reason=str(e))
+
 @app.get("/")
 async def root():
     """Root endpoint with API documentation."""
@@ -95,12 +1631,110 @@ async def root():
         "service": "Whisper STT Server",
         "version": "1.0.0",
         "endpoints": {
-            "POST /transcribe": "Transcribe audio file to text",
-            "GET /health": "Health check",
+            "POST /transcribe": "Transcribe audio file to text (profile: realtime | accurate; Accept: application/x-ndjson streams segments)",
+            "POST /transcribe/batch": "Transcribe many files in parallel (results in input order)",
+            "POST /transcribe/pcm": "Transcribe raw s16le mono PCM (?sample_rate=, X-Sample-Rate)",
+            "WS /transcribe/stream": "Incremental transcription of streamed PCM",
+            "GET /health": "Liveness check",
+            "GET /ready": "Readiness check (model loaded and warmed up)",
             "GET /": "This documentation"
         }
     }
 
+def _candidates(limit: int) -> list:
+    """Powers of two below limit, plus limit itself."""
+    values = []
+    value = 1
+    while value < limit:
+        values.append(value)
+        value *= 2
+    return values + [max(1, limit)]
+
+def autotune(reference: Optional[str], target_rtf: float, path: str) -> dict:
+    """
+    Benchmark compute types, threads per replica and replica counts for
+    MODEL_SIZE on this host, and save the configuration with the highest
+    throughput whose per-request real-time factor (processing time / audio
+    duration, under full load) stays within target_rtf.
+    """
+    import ctranslate2
+
+    if reference:
+        audio = decode_audio(reference, sampling_rate=SAMPLE_RATE)
+    else:
+        print("No --reference clip given: benchmarking on noise, which measures encoder cost only")
+        audio = np.random.default_rng(0).normal(0, 0.05, 10 * SAMPLE_RATE).astype(np.float32)
+    duration = len(audio) / SAMPLE_RATE
+    options = PROFILES[DEFAULT_PROFILE]
+    cores = os.cpu_count() or 1
+    supported = ctranslate2.get_supported_compute_types(DEVICE)
+    compute_types = [c for c in ("int8", "int8_float32", "float32") if c in supported]
+
+    def timed(model):
+        start = time.monotonic()
+        _transcribe(model, audio, options)
+        return time.monotonic() - start
+
+    results = []
+    for compute_type in compute_types:
+        max_workers = max(1, MODEL_MEMORY_MB // _footprint_mb(MODEL_SIZE, compute_type))
+        for threads in _candidates(cores):
+            for workers in _candidates(min(cores // threads, max_workers)):
+                replicas = [
+                    WhisperModel(MODEL_SIZE, device=DEVICE, compute_type=compute_type, cpu_threads=threads)
+                    for _ in range(workers)
+                ]
+                for replica in replicas:
+                    timed(replica)  # warm-up
+                start = time.monotonic()
+                with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+                    latencies = list(executor.map(timed, replicas))
+                wall = time.monotonic() - start
+                result = {
+                    "compute_type": compute_type,
+                    "cpu_threads": threads,
+                    "workers": workers,
+                    "rtf": round(max(latencies) / duration, 3),
+                    "throughput": round(workers * duration / wall, 2),  # audio seconds per second
+                }
+                print(f"  {result}")
+                results.append(result)
+                del replicas
+
+    eligible = [r for r in results if r["rtf"] <= target_rtf]
+    if eligible:
+        best = max(eligible, key=lambda r: (r["throughput"], -r["rtf"]))
+    else:
+        print(f"No configuration reaches RTF {target_rtf}; keeping the fastest per request")
+        best = min(results, key=lambda r: r["rtf"])
+
+    tuning = {
+        "model": MODEL_SIZE,
+        "device": DEVICE,
+        "cpu_count": cores,
+        "target_rtf": target_rtf,
+        "reference": reference,
+        "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        **best,
+    }
+    with open(path, "w") as f:
+        json.dump(tuning, f, indent=2)
+    print(f"Best configuration saved to {path}: {best}")
+    return tuning
+
 if __name__ == "__main__":
-    port = int(os.environ.get("WHISPER_PORT", 8001))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    parser = argparse.ArgumentParser(description="Whisper STT Server")
+    parser.add_argument("--autotune", action="store_true",
+                        help="Benchmark compute_type / cpu_threads / workers, save the best to WHISPER_TUNING_FILE and exit")
+    parser.add_argument("--reference", help="Audio clip to benchmark with (default: 10 s of noise)")
+    parser.add_argument("--target-rtf", type=float, default=TARGET_RTF,
+                        help="Highest acceptable real-time factor per request")
+    args = parser.parse_args()
+
+    if args.autotune and BACKEND != "faster-whisper":
+        parser.error("--autotune benchmarks the faster-whisper backend only")
+    if args.autotune:
+        autotune(args.reference, args.target_rtf, TUNING_FILE or "whisper_tuning.json")
+    else:
+        port = int(os.environ.get("WHISPER_PORT", 8001))
+        uvicorn.run(app, host="0.0.0.0", port=port)